@@ -249,6 +249,10 @@ class ArrayResource(Resource, ResourceInput, ResourceOutput):
                     data.append(new_item)
                 return cls(data)
 
+    @classmethod
+    def accepts_type(cls, t:type):
+        return issubclass(t, list)
+
 
     def show_data(self, label:str) -> QWidget:
         w = QWidget()
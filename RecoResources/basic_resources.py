@@ -111,6 +111,10 @@ class ValuedResource(Resource,ResourceInput, ResourceOutput):
             return cls(x)
         return None
 
+    @classmethod
+    def accepts_type(cls, t:type):
+        return cls.BaseType is not None and issubclass(t, cls.BaseType)
+
     @classmethod
     def validate(cls,value):
         """
@@ -269,6 +273,10 @@ class BlankResource(Resource, ResourceInput, ResourceOutput, Default):
             return cls()
         return None
 
+    @classmethod
+    def accepts_type(cls, t:type):
+        return t is type(None)
+
 
 
 class ChoiceInput(ResourceInputWidget):
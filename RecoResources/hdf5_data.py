@@ -1,16 +1,111 @@
 from typing import Optional
 import io, base64
 
-import h5py
 import numpy as np
 from PyQt6.QtWidgets import QLabel, QPushButton, QHBoxLayout, QFileDialog, QDialog, QTreeWidget, QTreeWidgetItem, \
     QVBoxLayout, QWidget, QMessageBox
 
 from RecoResources import Resource, ResourceInput, ResourceInputWidget, ResourceOutput
 from RecoResources.basic_resources import ValuedResource
+from RecoResources.lazy_module import lazy_import
 import workspace
 from pathlib import Path
 
+h5py = lazy_import("h5py")
+
+# Frames per chunk for statistics pass
+CHUNK_FRAMES = 4096
+# MAD to std of normal distribution
+MAD_TO_STD = 1.4826
+# Envelopes of derived series kept by HDF5Resource
+DERIVED_ENVELOPES = 8
+
+
+def has_frames(dataset):
+    return len(dataset.shape) > 0 and dataset.shape[0] > 0
+
+
+class DataStatistics(object):
+    '''
+    Per pixel reductions of signal along time axis (axis 0).
+    Computed in one pass chunk by chunk, so temporary arrays stay small. Dataset may be numpy array
+    or h5py dataset.
+    '''
+    FIELDS = ("max", "mean", "std", "argmax", "noise")
+
+    def __init__(self, max_, mean, std, argmax, noise):
+        self.max = max_
+        self.mean = mean
+        self.std = std
+        self.argmax = argmax
+        # Robust noise: MAD of first differences, insensitive to slow background and short pulses
+        self.noise = noise
+
+    def __repr__(self):
+        return f"{type(self).__name__}(shape={np.shape(self.max)})"
+
+    @classmethod
+    def compute(cls, dataset, chunk_frames=CHUNK_FRAMES):
+        if not has_frames(dataset):
+            raise ValueError("Cannot compute statistics of empty dataset")
+        length = dataset.shape[0]
+        max_ = None
+        argmax = None
+        mean = None
+        m2 = None
+        count = 0
+        mads = []
+        previous = None
+        for start in range(0, length, chunk_frames):
+            chunk = np.asarray(dataset[start:start+chunk_frames], dtype=np.float64)
+            n = chunk.shape[0]
+
+            chunk_max = np.max(chunk, axis=0)
+            chunk_argmax = np.argmax(chunk, axis=0)+start
+            if max_ is None:
+                max_ = chunk_max
+                argmax = chunk_argmax
+            else:
+                better = chunk_max > max_
+                max_ = np.where(better, chunk_max, max_)
+                argmax = np.where(better, chunk_argmax, argmax)
+
+            # Pairwise merge of mean and sum of squared deviations (Chan et al.)
+            chunk_mean = np.mean(chunk, axis=0)
+            chunk_m2 = np.sum((chunk-chunk_mean)**2, axis=0)
+            if mean is None:
+                mean = chunk_mean
+                m2 = chunk_m2
+            else:
+                total = count+n
+                delta = chunk_mean-mean
+                mean = mean+delta*n/total
+                m2 = m2+chunk_m2+delta**2*count*n/total
+            count += n
+
+            if previous is not None:
+                chunk = np.concatenate([previous, chunk])
+            if chunk.shape[0] > 1:
+                diffs = np.diff(chunk, axis=0)
+                mads.append(np.median(np.abs(diffs-np.median(diffs, axis=0)), axis=0))
+            previous = chunk[-1:]
+
+        if mads:
+            noise = MAD_TO_STD*np.median(mads, axis=0)/np.sqrt(2)
+        else:
+            noise = np.zeros_like(mean)
+        return cls(max_, mean, np.sqrt(m2/count), argmax, noise)
+
+    def to_arrays(self, prefix="stat_"):
+        return {prefix+field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix="stat_"):
+        keys = [prefix+field for field in cls.FIELDS]
+        if not all(key in arrays for key in keys):
+            return None
+        return cls(*[arrays[key] for key in keys])
+
 
 class TreeItem(QTreeWidgetItem):
     def __init__(self,main,path):
@@ -86,10 +181,58 @@ class HDF5ViewDialog(QDialog):
         dialog.exec()
         return dialog.result_field
 
+class EnvelopePyramid(object):
+    '''
+    Multi-resolution min/max envelope of signal along time axis (axis 0).
+    Each level aggregates factor times more frames than previous one, so any frame range
+    can be drawn with bounded number of points without losing peaks.
+    '''
+    def __init__(self, data, factor=4, min_length=1024):
+        self.data = data
+        self.factor = factor
+        # (frames per bin, mins, maxs), level 0 is data itself
+        self.levels = [(1, data, data)]
+        bin_size, mins, maxs = self.levels[0]
+        while mins.shape[0] > min_length:
+            # reduceat keeps last incomplete bin
+            starts = np.arange(0, mins.shape[0], factor)
+            mins = np.minimum.reduceat(mins, starts, axis=0)
+            maxs = np.maximum.reduceat(maxs, starts, axis=0)
+            bin_size *= factor
+            self.levels.append((bin_size, mins, maxs))
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def view(self, index, start, stop, max_bins):
+        '''
+        Envelope of one series in frame range [start, stop) at finest level with no more than max_bins bins.
+        :param index: pixel index, () for 1D data
+        :return: xs (bin centers), lower, upper (same array at full resolution)
+        '''
+        start = int(min(max(start, 0), len(self)))
+        stop = int(min(max(np.ceil(stop)+1, start), len(self)))
+        bin_size, mins, maxs = self.levels[-1]
+        for level in self.levels:
+            if (stop-start)/level[0] <= max_bins:
+                bin_size, mins, maxs = level
+                break
+        i0 = start//bin_size
+        i1 = -(-stop//bin_size)
+        s = (slice(i0, i1),)+tuple(index)
+        xs = np.arange(i0, i1)*bin_size+(bin_size-1)/2
+        if bin_size == 1:
+            series = mins[s]
+            return xs, series, series
+        return xs, mins[s], maxs[s]
+
+
 class HDF5ResourceInput(ResourceInputWidget):
     def __init__(self, refclass, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.content = None
+        # Kept between runs so caches built by resource are not lost
+        self._resource = HDF5Resource(None)
         self._shape_show = ""
         self._title = ""
         self._layout = QHBoxLayout()
@@ -104,9 +247,9 @@ class HDF5ResourceInput(ResourceInputWidget):
 
     def on_load_data(self):
 
-        data = self.refclass.try_load_data()
-        if data is not None:
-            self._set_content(data)
+        resource = self.refclass.try_load_data()
+        if resource is not None:
+            self._set_content(resource)
             self.trigger_callback()
 
     def _update_title(self):
@@ -120,12 +263,11 @@ class HDF5ResourceInput(ResourceInputWidget):
         self._update_title()
 
     def get_resource(self):
-        if self.content is None:
-            return HDF5Resource(None)
-        else:
-            return HDF5Resource(self.content)
+        return self._resource
 
-    def _set_content(self,content):
+    def _set_content(self,resource):
+        self._resource = resource
+        content = resource.value
         self.content = content
         if content is None:
             self._shape_show = ""
@@ -134,7 +276,7 @@ class HDF5ResourceInput(ResourceInputWidget):
         self._update_title()
 
     def set_resource(self,resource):
-        self._set_content(resource.value)
+        self._set_content(resource)
 
 
 class HDF5Resource(Resource,ResourceInput, ResourceOutput):
@@ -146,8 +288,46 @@ class HDF5Resource(Resource,ResourceInput, ResourceOutput):
     def create_widget(cls,*args,**kwargs):
         return cls.InputWidget(cls)
 
-    def __init__(self,value):
+    def __init__(self,value,statistics=None):
         self.value = value
+        self.statistics = statistics
+        self._envelope = None
+        self._derived_envelopes = dict()
+
+    def get_statistics(self) -> Optional[DataStatistics]:
+        '''
+        Cached per pixel statistics of data (see DataStatistics). Computed on first request if missing.
+        '''
+        if self.value is None or not has_frames(self.value):
+            return None
+        if self.statistics is None:
+            self.statistics = DataStatistics.compute(self.value)
+        return self.statistics
+
+    def get_envelope(self) -> Optional[EnvelopePyramid]:
+        '''
+        Min/max envelope pyramid of data for plotting. Built once, not saved with project.
+        '''
+        if self.value is None or not has_frames(self.value):
+            return None
+        if self._envelope is None:
+            self._envelope = EnvelopePyramid(self.value)
+        return self._envelope
+
+    def get_derived_envelope(self, key, make_series) -> Optional[EnvelopePyramid]:
+        '''
+        Envelope pyramid of series computed from data (e.g. sum of active pixels), cached by key.
+        :param key: hashable description of series (pixel selection, filter parameters, ...)
+        :param make_series: function of data returning array (time, ...)
+        '''
+        if self.value is None or not has_frames(self.value):
+            return None
+        if key not in self._derived_envelopes:
+            if len(self._derived_envelopes) >= DERIVED_ENVELOPES:
+                # Oldest entry goes first
+                del self._derived_envelopes[next(iter(self._derived_envelopes))]
+            self._derived_envelopes[key] = EnvelopePyramid(make_series(self.value))
+        return self._derived_envelopes[key]
 
     def __repr__(self):
         return f"{type(self).__name__}=({self.value})"
@@ -156,7 +336,10 @@ class HDF5Resource(Resource,ResourceInput, ResourceOutput):
         if self.value is None:
             return None
         compressed_array = io.BytesIO()
-        np.savez_compressed(compressed_array, self.value)
+        arrays = dict()
+        if self.statistics is not None:
+            arrays = self.statistics.to_arrays()
+        np.savez_compressed(compressed_array, self.value, **arrays)
         compressed_array.seek(0)
         bytes_array = compressed_array.read()
         return base64.b64encode(bytes_array).decode('ascii')
@@ -169,8 +352,13 @@ class HDF5Resource(Resource,ResourceInput, ResourceOutput):
         compressed_array = io.BytesIO()
         compressed_array.write(bytes_array)
         compressed_array.seek(0)
-        arr = np.load(compressed_array)["arr_0"]
-        return cls(arr)
+        loaded = np.load(compressed_array)
+        arr = loaded["arr_0"]
+        # Projects saved before statistics cache have array only
+        statistics = DataStatistics.from_arrays(loaded)
+        if statistics is None and has_frames(arr):
+            statistics = DataStatistics.compute(arr)
+        return cls(arr, statistics)
 
     def unwrap(self):
         return self.value
@@ -191,7 +379,11 @@ class HDF5Resource(Resource,ResourceInput, ResourceOutput):
             return None
         with h5py.File(asked) as fp:
             data = np.array(fp[field])
-            return data
+        # Resource keeps whole array anyway, so statistics are computed from memory without reading file again
+        statistics = None
+        if has_frames(data):
+            statistics = DataStatistics.compute(data)
+        return cls(data, statistics)
 
     def show_data(self, label:str) ->QWidget:
         w = QWidget()
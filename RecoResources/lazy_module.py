@@ -0,0 +1,81 @@
+import importlib
+import threading
+
+
+class LazyModule(object):
+    """
+    Module placeholder. Real module is imported on first attribute access.
+    Used for heavy libraries (pymc, pytensor, arviz) so they don't slow down application start.
+    """
+    def __init__(self, name, on_load=None):
+        self._name = name
+        self._on_load = on_load
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            if self._on_load is not None:
+                self._on_load(module)
+            self._module = module
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, item):
+        if item.startswith("_"):
+            raise AttributeError(item)
+        return getattr(self.load(), item)
+
+    def __dir__(self):
+        return dir(self.load())
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<lazy module {self._name} ({state})>"
+
+
+LAZY_MODULES = []
+PRELOAD_THREAD = None
+
+
+def lazy_import(name, on_load=None) -> LazyModule:
+    """
+    Create placeholder for module which is imported on first use
+    :param name: full module name (e.g. "pytensor.tensor")
+    :param on_load: optional callback receiving module right after import
+    """
+    module = LazyModule(name, on_load)
+    LAZY_MODULES.append(module)
+    return module
+
+
+def preload_lazy_modules(callback=None):
+    """
+    Import all pending lazy modules in background thread.
+    :param callback: called without arguments from the worker thread when loading is done
+    """
+    def target():
+        for module in list(LAZY_MODULES):
+            try:
+                module.load()
+            except ImportError as e:
+                print(f"Preloading {module._name} failed: {e}")
+        if callback is not None:
+            callback()
+
+    global PRELOAD_THREAD
+    PRELOAD_THREAD = threading.Thread(target=target, name="lazy-module-preload", daemon=True)
+    PRELOAD_THREAD.start()
+    return PRELOAD_THREAD
+
+
+def wait_for_preload():
+    """
+    Block until background preload finishes. Call it before forking processes:
+    child would inherit import locks held by preload thread.
+    """
+    if PRELOAD_THREAD is not None:
+        PRELOAD_THREAD.join()
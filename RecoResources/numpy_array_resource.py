@@ -81,5 +81,9 @@ class NumpyArrayResource(Resource, ResourceOutput):
             return cls(x)
         return None
 
+    @classmethod
+    def accepts_type(cls, t:type):
+        return issubclass(t, np.ndarray)
+
     def show_data(self, label: str) -> QWidget:
         return ArrayDisplay(label, self.value)
@@ -1,13 +1,34 @@
 import numpy as np
-import pymc as pm
-import pytensor.tensor as pt
 from RecoResources import CombineResource, AlternatingResource, BlankResource, ResourceRequest, StrictFunction, OptionResource
 from RecoResources import FloatResource, ResourceVariant, ResourceStorage
+from RecoResources.lazy_module import lazy_import
 # from scipy.special import erfinv
 
+pm = lazy_import("pymc")
+pt = lazy_import("pytensor.tensor")
+
+
+def distribution_shape(kwargs):
+    """
+    Shape of distribution requested with shape or dims keyword. None for scalar
+    """
+    if kwargs.get("shape") is not None:
+        return tuple(np.atleast_1d(kwargs["shape"]))
+    if kwargs.get("dims") is not None:
+        model = pm.modelcontext(None)
+        dims = kwargs["dims"]
+        if isinstance(dims, str):
+            dims = (dims,)
+        return tuple(int(model.dim_lengths[d].eval()) for d in dims)
+    return None
+
 
 class DistributionMaker(object):
-    def create_distribution(self, name:str):
+    def create_distribution(self, name:str, **kwargs):
+        """
+        Create named model variable
+        :param kwargs: shape or dims of vector valued variable
+        """
         raise NotImplementedError
 
     def get_dist(self):
@@ -24,8 +45,8 @@ class DistributionMaker(object):
 class FlatMaker(BlankResource, DistributionMaker):
     Label = "Flat"
 
-    def create_distribution(self,name:str):
-        return pm.Flat(name)
+    def create_distribution(self, name:str, **kwargs):
+        return pm.Flat(name, **kwargs)
 
     def get_dist(self):
         return pm.Flat.dist()
@@ -38,8 +59,8 @@ class FlatMaker(BlankResource, DistributionMaker):
 class HalfFlatMaker(BlankResource, DistributionMaker):
     Label = "HalfFlat"
 
-    def create_distribution(self,name:str):
-        return pm.HalfFlat(name)
+    def create_distribution(self, name:str, **kwargs):
+        return pm.HalfFlat(name, **kwargs)
 
     def get_dist(self):
         return pm.HalfFlat.dist()
@@ -55,10 +76,11 @@ class NormalMaker(CombineResource, DistributionMaker):
         "sigma":dict(display_name="Std", default_value=1.0),
     })
 
-    def create_distribution(self, name:str):
+    def create_distribution(self, name:str, **kwargs):
         return pm.Normal(name,
                          mu=self.data.get("mu"),
-                         sigma=self.data.get("sigma")
+                         sigma=self.data.get("sigma"),
+                         **kwargs
                          )
 
     def get_dist(self):
@@ -83,10 +105,11 @@ class LaplaceMaker(CombineResource, DistributionMaker):
         "b":dict(display_name="Scale", default_value=1.0),
     })
 
-    def create_distribution(self, name:str):
+    def create_distribution(self, name:str, **kwargs):
         return pm.Laplace(name,
                          mu=self.data.get("mu"),
-                         b=self.data.get("b")
+                         b=self.data.get("b"),
+                         **kwargs
                          )
 
     def get_dist(self):
@@ -112,12 +135,12 @@ class UniformMaker(CombineResource, DistributionMaker):
         "upper": dict(display_name="Upper", default_value=1.0),
     })
 
-    def create_distribution(self, name:str):
+    def create_distribution(self, name:str, **kwargs):
         lower = self.data.get("lower")
         upper = self.data.get("upper")
         if lower>upper:
             lower, upper = upper, lower
-        return pm.Uniform(name,lower=lower,upper=upper)
+        return pm.Uniform(name,lower=lower,upper=upper,**kwargs)
 
     def get_dist(self):
         lower = self.data.get("lower")
@@ -143,12 +166,12 @@ class HalfNormalMaker(CombineResource, DistributionMaker):
         "negate":dict(display_name="Negate",default_value=False)
     })
 
-    def create_distribution(self, name:str):
+    def create_distribution(self, name:str, **kwargs):
         if self.data.get("negate"):
-            neg = pm.HalfNormal(name+"_neg_", sigma=self.data.get("sigma"))
-            return pm.Deterministic(name,-neg)
+            neg = pm.HalfNormal(name+"_neg_", sigma=self.data.get("sigma"), **kwargs)
+            return pm.Deterministic(name,-neg,dims=kwargs.get("dims"))
         else:
-            return pm.HalfNormal(name,sigma=self.data.get("sigma"))
+            return pm.HalfNormal(name,sigma=self.data.get("sigma"),**kwargs)
 
     def get_dist(self):
         d = pm.HalfNormal.dist(sigma=self.data.get("sigma"))
@@ -180,12 +203,12 @@ class ExponentialMaker(CombineResource, DistributionMaker):
         "negate":dict(display_name="Negate",default_value=False)
     })
 
-    def create_distribution(self, name:str):
+    def create_distribution(self, name:str, **kwargs):
         if self.data.get("negate"):
-            neg = pm.Exponential(name+"_neg_", lam=self.data.get("lam"))
-            return pm.Deterministic(name,-neg)
+            neg = pm.Exponential(name+"_neg_", lam=self.data.get("lam"), **kwargs)
+            return pm.Deterministic(name,-neg,dims=kwargs.get("dims"))
         else:
-            return pm.Exponential(name,lam=self.data.get("lam"))
+            return pm.Exponential(name,lam=self.data.get("lam"),**kwargs)
 
     def get_dist(self):
         d = pm.Exponential.dist(lam=self.data.get("lam"))
@@ -215,9 +238,13 @@ class ConstantMaker(CombineResource, DistributionMaker):
         "value":dict(display_name="Value", default_value=0.0)
     })
 
-    def create_distribution(self, name: str):
-        const = pt.constant(self.data.get("value"))
-        return pm.Deterministic(name, const)
+    def create_distribution(self, name:str, **kwargs):
+        shape = distribution_shape(kwargs)
+        if shape is None:
+            const = pt.constant(self.data.get("value"))
+        else:
+            const = pt.fill(pt.zeros(shape), self.data.get("value"))
+        return pm.Deterministic(name, const, dims=kwargs.get("dims"))
 
     def get_dist(self):
         const = pt.constant(self.data.get("value"))
@@ -239,10 +266,11 @@ class CauchyMaker(CombineResource, DistributionMaker):
         "beta": dict(display_name="Scale", default_value=1.0),
     })
 
-    def create_distribution(self, name:str):
+    def create_distribution(self, name:str, **kwargs):
         return pm.Cauchy(name,
                          alpha=self.data.get("alpha"),
-                         beta=self.data.get("beta")
+                         beta=self.data.get("beta"),
+                         **kwargs
                          )
 
     def get_dist(self):
@@ -271,8 +299,8 @@ class VonMisesMaker(CombineResource, DistributionMaker):
     def get_dist(self):
         return pm.VonMises.dist(mu=self.data.get("mu"),kappa=self.data.get("kappa"))
 
-    def create_distribution(self, name:str):
-        return pm.VonMises(name,mu=self.data.get("mu"),kappa=self.data.get("kappa"))
+    def create_distribution(self, name:str, **kwargs):
+        return pm.VonMises(name,mu=self.data.get("mu"),kappa=self.data.get("kappa"),**kwargs)
 
     def get_estimation(self):
         return self.data.get("mu")
@@ -284,6 +312,32 @@ class VonMisesMaker(CombineResource, DistributionMaker):
         data.set("kappa",kappa)
         return DistributionResource(VonMisesMaker(data))
 
+class CircularDirectionMaker(CombineResource, DistributionMaker):
+    Fields = ResourceRequest({
+        "mu": dict(display_name="Mean direction [deg]", default_value=0.0),
+        "concentration": dict(display_name="Concentration", default_value=0.0)
+    })
+
+    def create_distribution(self, name:str, **kwargs):
+        # Unconstrained 2D vector. Its direction is the angle, so there is no boundary at 0/360.
+        # Zero concentration gives uniform direction.
+        mu = self.data.get("mu")*np.pi/180.0
+        r = self.data.get("concentration")
+        shape = distribution_shape(kwargs) or ()
+        vec = pm.Normal(name+"_vec_", mu=[r*np.cos(mu), r*np.sin(mu)], sigma=1.0, shape=shape+(2,))
+        angle = pt.arctan2(vec[..., 1], vec[..., 0])*180.0/np.pi
+        return pm.Deterministic(name, pt.mod(angle, 360.0), dims=kwargs.get("dims"))
+
+    def get_estimation(self):
+        return self.data.get("mu")
+
+    @staticmethod
+    def template(mu, concentration):
+        data = ResourceStorage()
+        data.set("mu", mu)
+        data.set("concentration", concentration)
+        return DistributionResource(CircularDirectionMaker(data))
+
 class DistributionResource(AlternatingResource):
     Variants = [
         ResourceVariant(ConstantMaker,"Constant"),
@@ -299,10 +353,11 @@ class DistributionResource(AlternatingResource):
         ResourceVariant(HalfFlatMaker, "Half-flat"),
 
         ResourceVariant(VonMisesMaker, "VonMises"),
+        ResourceVariant(CircularDirectionMaker, "Circular direction [deg]"),
     ]
 
-    def create_distribution(self, name:str):
-        return self.value.create_distribution(name)
+    def create_distribution(self, name:str, **kwargs):
+        return self.value.create_distribution(name, **kwargs)
 
     def get_estimation(self):
         return self.value.get_estimation()
@@ -313,22 +368,29 @@ class LimitOption(OptionResource):
     OptionType = FloatResource
 
 
+class TruncatableDistributionResource(DistributionResource):
+    # Circular direction is deterministic function of 2D vector, it has no dist to truncate
+    Variants = [variant for variant in DistributionResource.Variants
+                if variant.get_default_value_type() is not CircularDirectionMaker]
+
+
 class TruncatedMaker(CombineResource, DistributionMaker):
     Fields = ResourceRequest({
         "lower": dict(display_name="lower", default_value=LimitOption(None)),
         "upper": dict(display_name="upper", default_value=LimitOption(None)),
-        "dist": dict(display_name="upper", type_=DistributionResource)
+        "dist": dict(display_name="upper", type_=TruncatableDistributionResource)
     })
 
-    def create_distribution(self, name: str):
+    def create_distribution(self, name:str, **kwargs):
         dr = self.data.get("dist")
         if isinstance(dr, ConstantMaker):
-            return dr.create_distribution(name)
+            return dr.create_distribution(name, **kwargs)
         dist = dr.get_dist()
         return pm.Truncated(name,
                             lower=self.data.get("lower"),
                             upper=self.data.get("upper"),
                             dist=dist,
+                            **kwargs
                             )
 
     def get_dist(self):
@@ -346,6 +408,7 @@ class TruncatedMaker(CombineResource, DistributionMaker):
 
 
 DistributionResource.Variants.append(ResourceVariant(TruncatedMaker, "Truncated"))
+TruncatableDistributionResource.Variants.append(ResourceVariant(TruncatedMaker, "Truncated"))
 
 
 def template_uniform(a,b):
@@ -360,6 +423,10 @@ def template_normal(mu,sigma):
     return NormalMaker.template(mu,sigma)
 
 
+def template_circular(mu,concentration):
+    return CircularDirectionMaker.template(mu,concentration)
+
+
 def template_exponent(lam,negate):
     return ExponentialMaker.template(lam,negate)
 
@@ -6,14 +6,24 @@ from PyQt6.QtWidgets import QWidget, QVBoxLayout, QLabel, QTableWidget, QTableWi
 from PyQt6.QtWidgets import QLineEdit
 from PyQt6.QtGui import QIntValidator
 from PyQt6 import QtCore
-from arviz.data.inference_data import  InferenceData
-import arviz as az
-import pandas as pd
+import sys
 
 from RecoResources.resource import Resource
 from RecoResources.resource_output import ResourceOutput
+from RecoResources.lazy_module import lazy_import
 
-az.rcParams['data.load'] = 'eager'
+
+def _setup_arviz(module):
+    module.rcParams['data.load'] = 'eager'
+
+
+az = lazy_import("arviz", _setup_arviz)
+
+
+def is_inference_data(x):
+    # Nothing can be InferenceData until arviz is imported by someone, no need to import it here
+    module = sys.modules.get("arviz.data.inference_data")
+    return module is not None and isinstance(x, module.InferenceData)
 
 class TraceDisplay(QWidget):
     def __init__(self,label,trace,*args,**kwargs):
@@ -135,7 +145,7 @@ class TraceDisplay(QWidget):
             fig.show()
 
 class TraceResource(Resource, ResourceOutput):
-    def __init__(self,trace:InferenceData):
+    def __init__(self,trace:"az.InferenceData"):
         self.trace = trace
 
     def serialize(self):
@@ -154,7 +164,7 @@ class TraceResource(Resource, ResourceOutput):
         with open(tgt_file,"wb") as fp:
             decoded = base64.b64decode(data.encode("ascii"))
             fp.write(decoded)
-        trace = InferenceData.from_netcdf(tgt_file)
+        trace = az.InferenceData.from_netcdf(tgt_file)
         shutil.rmtree(tempdir)
         return cls(trace)
 
@@ -163,9 +173,14 @@ class TraceResource(Resource, ResourceOutput):
 
     @classmethod
     def try_from(cls, x):
-        if isinstance(x, InferenceData):
+        if is_inference_data(x):
             return cls(x)
         return None
 
+    @classmethod
+    def accepts_type(cls, t:type):
+        module = sys.modules.get("arviz.data.inference_data")
+        return module is not None and issubclass(t, module.InferenceData)
+
     def show_data(self, label:str) -> QWidget:
         return TraceDisplay(label,self.trace)
\ No newline at end of file
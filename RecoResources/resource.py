@@ -3,11 +3,29 @@ from typing import Type
 from PyQt6.QtWidgets import QWidget, QFrame, QVBoxLayout
 
 
+def _method_owner(cls, name):
+    for c in cls.__mro__:
+        if name in c.__dict__:
+            return c
+    return None
+
+
 class Resource(object):
     """
     Base resource class
     """
     SUBCLASSES = None
+    # identifier -> class. Filled as classes are defined (newest definition wins) and on indexing
+    REGISTRY = dict()
+    # python type -> subclasses that may convert values of this type (see try_transform)
+    TRANSFORM_CANDIDATES = dict()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        Resource.REGISTRY[cls.identifier()] = cls
+        # Subclass list and dispatch cache will be rebuilt on demand
+        Resource.SUBCLASSES = None
+        Resource.TRANSFORM_CANDIDATES.clear()
 
     @classmethod
     def identifier(cls):
@@ -52,18 +70,20 @@ class Resource(object):
                 workon.extend(elem.__subclasses__())
 
             cls.SUBCLASSES = subclasses
+            for c in subclasses:
+                if c.identifier() not in Resource.REGISTRY.keys():
+                    Resource.REGISTRY[c.identifier()] = c
+            Resource.TRANSFORM_CANDIDATES.clear()
 
     @classmethod
     def unpack(cls, data:dict):
         """
         Recover resource made with pack() function. Will guess its type.
         """
-        Resource.index_subclasses()
-        #print("CLTEST",cls.SUBCLASSES)
-        for c in cls.SUBCLASSES:
-            if c.identifier()==data["class"]:
-                return c.deserialize(data["data"])
-        print("Available subclasses:",[i.__name__ for i in cls.SUBCLASSES])
+        c = Resource.REGISTRY.get(data["class"])
+        if c is not None:
+            return c.deserialize(data["data"])
+        print("Available subclasses:",list(Resource.REGISTRY.keys()))
         raise ValueError(f"Unknown resource of type {data['class']}")
 
     @classmethod
@@ -85,8 +105,12 @@ class Resource(object):
         Attempts to create resource from other type by picking suiting resource
         """
         Resource.index_subclasses()
-        # print("CLTEST",cls.SUBCLASSES)
-        for c in cls.SUBCLASSES:
+        t = type(data)
+        candidates = Resource.TRANSFORM_CANDIDATES.get(t)
+        if candidates is None:
+            candidates = [c for c in Resource.SUBCLASSES if c._may_transform(t)]
+            Resource.TRANSFORM_CANDIDATES[t] = candidates
+        for c in candidates:
             test = c.try_from(data)
             if test is not None:
                 return test
@@ -105,6 +129,26 @@ class Resource(object):
         """
         return None
 
+    @classmethod
+    def accepts_type(cls, t:type):
+        """
+        Quick check if try_from may accept values of python type t. Used to prefilter try_transform.
+        Must not return False for types that try_from can convert.
+        Override it together with try_from.
+        """
+        return True
+
+    @classmethod
+    def _may_transform(cls, t:type):
+        try_from_owner = _method_owner(cls, "try_from")
+        if try_from_owner is Resource:
+            # Default try_from never converts anything
+            return False
+        if _method_owner(cls, "accepts_type") is not try_from_owner:
+            # Type hint was written for another try_from
+            return True
+        return cls.accepts_type(t)
+
 
 class ResourceStorage(object):
     """
@@ -1,4 +1,78 @@
+import hashlib
+import importlib.util
+import marshal
+import os
+import sys
+import tempfile
+import types
+
 from RecoResources.file_content_resource import FileLoadedResource
+import workspace
+
+
+SCRIPT_CACHE_DIRS = [
+    os.path.join(workspace.USER_DATA_DIR, "__pycache__", "reco_scripts"),
+    os.path.join(tempfile.gettempdir(), "reco_scripts"),
+]
+
+# content hash -> code object
+CODE_CACHE = dict()
+
+
+def _write_atomic(path, data:bytes):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as fp:
+        fp.write(data)
+    os.replace(tmp_path, path)
+
+
+def _compile_in_dir(cache_dir, key, source:str):
+    os.makedirs(cache_dir, exist_ok=True)
+    # Source is stored too: code objects (and numba on-disk cache) need real file behind them.
+    # File name contains content hash, so once written file never changes.
+    src_path = os.path.join(cache_dir, f"script_{key}.py")
+    code_path = os.path.join(cache_dir, f"script_{key}.bin")
+    if not os.path.isfile(src_path):
+        _write_atomic(src_path, source.encode("utf-8"))
+
+    if os.path.isfile(code_path):
+        with open(code_path, "rb") as fp:
+            data = fp.read()
+        magic = importlib.util.MAGIC_NUMBER
+        if data[:len(magic)] == magic:
+            try:
+                return marshal.loads(data[len(magic):])
+            except (EOFError, ValueError, TypeError):
+                pass
+
+    code = compile(source, src_path, "exec")
+    _write_atomic(code_path, importlib.util.MAGIC_NUMBER + marshal.dumps(code))
+    return code
+
+
+def script_key(source:str):
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:32]
+
+
+def compile_script(source:str):
+    """
+    Compile script source. Code objects are cached in memory and on disk by content hash.
+    """
+    key = script_key(source)
+    code = CODE_CACHE.get(key)
+    if code is not None:
+        return code
+    for cache_dir in SCRIPT_CACHE_DIRS:
+        try:
+            code = _compile_in_dir(cache_dir, key, source)
+            break
+        except OSError:
+            continue
+    else:
+        print("Script cache is not available")
+        code = compile(source, "<script>", "exec")
+    CODE_CACHE[key] = code
+    return code
 
 
 class ScriptResource(FileLoadedResource):
@@ -13,4 +87,10 @@ class ScriptResource(FileLoadedResource):
         #
         if self.value is not None:
             #print("Script", self.value.unwrap())
-            exec(self.value.unwrap(),globals_)
\ No newline at end of file
+            source = self.value.unwrap()
+            # Script is executed as registered module: numba needs importable module to load cached kernels
+            module = types.ModuleType(f"reco_script_{script_key(source)}")
+            module.__dict__.update(globals_)
+            sys.modules[module.__name__] = module
+            exec(compile_script(source), module.__dict__)
+            globals_.update(module.__dict__)
@@ -77,6 +77,10 @@ class StarListResource(Resource,ResourceInput,Default,ResourceOutput):
         if isinstance(x, StarList):
             return cls(x)
 
+    @classmethod
+    def accepts_type(cls, t:type):
+        return issubclass(t, StarList)
+
     def show_data(self, label:str) -> QWidget:
         qw = QWidget()
         layout = QVBoxLayout()
@@ -82,3 +82,7 @@ class TimeResource(Default, Resource, ResourceInput, ResourceOutput):
     def try_from(cls, x):
         if isinstance(x, datetime):
             return cls(x)
+
+    @classmethod
+    def accepts_type(cls, t:type):
+        return issubclass(t, datetime)
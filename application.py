@@ -14,8 +14,12 @@ from PyQt6.QtCore import QSize, QRunnable, pyqtSlot, pyqtSignal, QObject, QThrea
 from RecoResources import ResourceForm, ResourceDisplay, ResourceStorage, ResourceRequest, ScriptResource, Resource
 from reconstruction_model import ReconsructionModel
 from RecoResources import DisplayList
+from RecoResources.lazy_module import wait_for_preload
+from RecoResources.pymc_trace import TraceResource, az
 from button_list import ButtonPanel
 import workspace
+import startup_profile
+import progress_report
 
 from scene import Drawer
 
@@ -23,6 +27,8 @@ import matplotlib, sys
 matplotlib.use('Qt5Agg')
 
 SCRIPT_KEY = "SCRIPT"
+# Optional model field with floating point precision of model tensors
+PRECISION_KEY = "precision"
 BASEDIR = os.path.dirname(os.path.realpath("__file__"))
 STOCK_SRCDIR = os.path.join(BASEDIR,"stock_models")
 STOCK_COMMONS_SRCDIR = os.path.join(BASEDIR,"stock_commons")
@@ -59,7 +65,7 @@ class RecoResourcesBundle(object):
         newstate = self.deserialize(state)
         if newstate is None:
             raise RuntimeError("Cannot deserialize reco resources")
-        self.__dict = newstate.__dict__
+        self.__dict__.update(newstate.__dict__)
 
     @staticmethod
     def default():
@@ -121,7 +127,14 @@ class RecoResourcesBundle(object):
     def run_model(self):
         if self.runner is None:
             return
-        self.runner.calculate(self.resource_storage)
+        precision = self.resource_storage.try_get(PRECISION_KEY)
+        if precision is None:
+            self.runner.calculate(self.resource_storage)
+        else:
+            # Model tensors are created in chosen precision
+            import pytensor
+            with pytensor.config.change_flags(floatX=precision):
+                self.runner.calculate(self.resource_storage)
 
     def get_actions(self):
         if self.runner is None:
@@ -193,12 +206,15 @@ def add_modules_dir(s):
 
 
 class Worker(Process):
-    def __init__(self, state, tx):
+    def __init__(self, resources:RecoResourcesBundle, tx):
         super().__init__()
         self.tx = tx
-        self.resources = RecoResourcesBundle.deserialize(state)
+        # Forked worker inherits loaded script and compiled kernels.
+        # Other start methods pickle bundle and rerun script from code cache.
+        self.resources = resources
 
     def run(self):
+        progress_report.set_channel(self.tx)
         try:
             self.resources.run_model()
             print("Model run is done")
@@ -207,37 +223,64 @@ class Worker(Process):
             (fd,path) = tempfile.mkstemp()
             with os.fdopen(fd, 'w') as f:
                 f.write(json.dumps(ser))
-            self.tx.send(path)
+            self.tx.send(("result", path))
             print("Job is done")
         except:
             print("ERROR ocurred")
             traceback.print_exc()
+            self.tx.send(("error", traceback.format_exc()))
+
+
+class WorkerListener(QThread):
+    """
+    Receives worker events and forwards them as signals. Finishes when worker closes its pipe end.
+    """
+    progress = pyqtSignal(object)
+    partial_trace = pyqtSignal(object)
+    job_failed = pyqtSignal(str)
+    job_finished = pyqtSignal(object)
 
+    def __init__(self, worker:Worker, rx, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.worker = worker
+        self.rx = rx
+
+    def run(self):
+        result = None
+        while True:
+            try:
+                kind, payload = self.rx.recv()
+            except (EOFError, OSError):
+                break
+            if kind == "progress":
+                self.progress.emit(payload)
+            elif kind == "partial_trace":
+                self.partial_trace.emit(payload)
+            elif kind == "error":
+                self.job_failed.emit(payload)
+            elif kind == "result":
+                with open(payload) as f:
+                    result = json.load(f)
+                os.remove(payload)
+        print("Worker is finished. Joining...")
+        self.worker.join()
+        print("Worker is finished. Joined")
+        self.rx.close()
+        self.job_finished.emit(result)
 
 
 class WorkerHandler(object):
     def __init__(self,resources:RecoResourcesBundle):
-        conn1,conn2 = Pipe()
-        self.worker = Worker(resources.serialize(),conn2)
-        self.rx = conn1
+        conn1,conn2 = Pipe(duplex=False)
+        wait_for_preload()
+        self.worker = Worker(resources,conn2)
         self.worker.start()
-        self.result = None
+        # Only worker keeps sending end open, so listener gets EOF when worker exits
+        conn2.close()
+        self.listener = WorkerListener(self.worker, conn1)
 
-    def check_result(self):
-        if self.worker.is_alive():
-            return 0,None
-        else:
-            print("Worker is finished. Joining...")
-            self.worker.join()
-            print("Worker is finished. Joined")
-            if self.rx.poll():
-                path = self.rx.recv()
-                with open(path) as f:
-                    dat = json.load(f)
-                os.remove(path)
-                return 1, RecoResourcesBundle.deserialize(dat)
-            else:
-                return 1, None
+    def start_listening(self):
+        self.listener.start()
 
     def interrupt(self):
         if self.worker.is_alive():
@@ -304,6 +347,7 @@ class PADAMOReco(QMainWindow):
         self.add_action("Forget zooming",self.on_forget_zooms)
         self.add_action("Reconstruct",self.on_run)
         self.add_action("Stop reconstruction",self.on_stop)
+        self.add_action("Show partial trace",self.on_show_partial_trace)
 
         #self.right_panel_data.addStretch()
         self.inputs_panel = ResourceForm(placeholder="No inputs", categorize=True)
@@ -315,6 +359,7 @@ class PADAMOReco(QMainWindow):
         self.right_panel_data.addWidget(self.inputs_panel)
         self._sync_resources()
 
+        startup_profile.mark_stage("main window construction")
         if workspace.Workspace.has_dir():
             print("Workspace is set. Using workspace commons")
             ws = workspace.Workspace("reco_commons")
@@ -323,13 +368,14 @@ class PADAMOReco(QMainWindow):
         else:
             print("No workspace is set. Using local commons")
             add_modules_dir(STOCK_COMMONS_SRCDIR)
+        startup_profile.mark_stage("commons modules")
         self.plotter.replot_hook = self.replot_hook
         self.plotter.event_sync_hook = self.event_sync_hook
 
         self.worker = None
-        self.worker_timer = QTimer()
-        self.worker_timer.timeout.connect(self.monitor_worker)
-        self.worker_timer.start(1000)
+        self.partial_posterior = None
+        self.worker_error = None
+        self.partial_trace_window = None
 
     def on_dry_run(self):
         self._pull_inputs()
@@ -449,20 +495,63 @@ class PADAMOReco(QMainWindow):
     def on_run(self):
         self._pull_inputs()
         if self.worker is None:
+            self.partial_posterior = None
+            self.worker_error = None
             self.worker = WorkerHandler(self.resources)
+            self.worker.listener.progress.connect(self.on_worker_progress)
+            self.worker.listener.partial_trace.connect(self.on_worker_partial_trace)
+            self.worker.listener.job_failed.connect(self.on_worker_failed)
+            self.worker.listener.job_finished.connect(self.on_worker_finished)
+            self.worker.start_listening()
+            self.statusBar().showMessage("Reconstruction started")
+
+    def on_worker_progress(self, state:dict):
+        elapsed = state.get("elapsed", 0.0)
+        if "chains" in state:
+            tune = state["tune"]
+            draws = state["draws"]
+            parts = []
+            for chain in state["chains"]:
+                if chain["drawn"] == 0 and chain["tuned"] < tune:
+                    parts.append(f"#{chain['chain']} tune {chain['tuned']}/{tune}")
+                else:
+                    parts.append(f"#{chain['chain']} draw {chain['drawn']}/{draws} div {chain['divergences']}")
+            text = "; ".join(parts)
+        else:
+            text = f"iteration {state.get('iteration')}/{state.get('n')} loss {state.get('loss', float('nan')):.4g}"
+        self.statusBar().showMessage(f"[{elapsed:.0f} s] {text}")
 
-    def monitor_worker(self):
-        if self.worker is not None:
-            self.worker:WorkerHandler
-            status,res = self.worker.check_result()
-            if status == 1:
-                print("Worker returned finishing status")
-                self.worker = None
-                if res is not None:
-                    self.resources = res
-                    self.update_outputs()
-                    print("Reco OK")
-                    QMessageBox.information(self,"Reco status", "Reco finished")
+    def on_worker_partial_trace(self, posterior:dict):
+        self.partial_posterior = posterior
+
+    def on_show_partial_trace(self):
+        if self.partial_posterior is None:
+            QMessageBox.information(self, "Partial trace", "No partial trace received yet")
+            return
+        trace = az.from_dict(posterior=self.partial_posterior)
+        self.partial_trace_window = TraceResource(trace).show_data("Partial trace")
+        self.partial_trace_window.setWindowTitle("Partial trace")
+        self.partial_trace_window.show()
+
+    def on_worker_failed(self, error:str):
+        print(error)
+        self.worker_error = error
+
+    def on_worker_finished(self, res):
+        print("Worker returned finishing status")
+        self.worker.listener.wait()
+        self.worker = None
+        if res is not None:
+            self.resources = RecoResourcesBundle.deserialize(res)
+            self.update_outputs()
+            print("Reco OK")
+            self.statusBar().showMessage("Reconstruction finished")
+            QMessageBox.information(self,"Reco status", "Reco finished")
+        elif self.worker_error is not None:
+            self.statusBar().showMessage("Reconstruction failed")
+            QMessageBox.critical(self, "Reco status", f"Reconstruction failed:\n{self.worker_error}")
+        else:
+            self.statusBar().showMessage("Reconstruction stopped")
 
 
 
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Measures time spent opening saved projects with registry based Resource dispatch
+and with the old linear scan over all resource subclasses.
+
+Run from repository root:
+    PYTHONPATH=. python freestanding_scripts/project_open_benchmark/main.py [project.json ...]
+"""
+import os, sys, glob, time, json
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+from PyQt6.QtWidgets import QApplication
+
+app = QApplication(sys.argv[:1])
+
+import matplotlib
+import application
+matplotlib.use("Agg")
+from application import RecoResourcesBundle, add_modules_dir, STOCK_COMMONS_SRCDIR
+from RecoResources import Resource, ResourceStorage
+
+REPEATS = 3
+DEFAULT_PROJECTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "expexp_linlin_curves", "model_*.json")
+
+
+def legacy_unpack(cls, data: dict):
+    Resource.index_subclasses()
+    for c in Resource.SUBCLASSES:
+        if c.identifier() == data["class"]:
+            return c.deserialize(data["data"])
+    raise ValueError(f"Unknown resource of type {data['class']}")
+
+
+def legacy_try_transform(cls, data):
+    Resource.index_subclasses()
+    for c in Resource.SUBCLASSES:
+        test = c.try_from(data)
+        if test is not None:
+            return test
+    return None
+
+
+class Counter(object):
+    def __init__(self, func):
+        self.func = func
+        self.calls = 0
+        self.elapsed = 0.0
+
+    def __call__(self, cls, data):
+        self.calls += 1
+        start = time.perf_counter()
+        try:
+            return self.func(cls, data)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+
+def measure(path, unpack, try_transform):
+    # Times are inclusive: nested resources are unpacked inside their parents
+    unpack_counter = Counter(unpack)
+    transform_counter = Counter(try_transform)
+    saved = Resource.__dict__["unpack"], Resource.__dict__["try_transform"]
+    Resource.unpack = classmethod(unpack_counter)
+    Resource.try_transform = classmethod(transform_counter)
+    try:
+        with open(path, "r") as fp:
+            data = json.load(fp)
+        start = time.perf_counter()
+        bundle = RecoResourcesBundle.from_resources(ResourceStorage.deserialize(data))
+        total = time.perf_counter() - start
+    finally:
+        Resource.unpack, Resource.try_transform = saved
+    assert bundle is not None
+    return total, unpack_counter, transform_counter
+
+
+def main():
+    add_modules_dir(STOCK_COMMONS_SRCDIR)
+    projects = sys.argv[1:] or sorted(glob.glob(DEFAULT_PROJECTS))
+    variants = [
+        ("legacy", legacy_unpack, legacy_try_transform),
+        ("registry", Resource.__dict__["unpack"].__func__, Resource.__dict__["try_transform"].__func__),
+    ]
+    for path in projects:
+        print(os.path.basename(path))
+        for name, unpack, try_transform in variants:
+            best = None
+            for _ in range(REPEATS):
+                result = measure(path, unpack, try_transform)
+                if best is None or result[0] < best[0]:
+                    best = result
+            total, u, t = best
+            print(f"  {name:9s} open {total*1000:9.1f} ms | "
+                  f"unpack {u.calls:5d} calls {u.elapsed*1000:8.2f} ms | "
+                  f"try_transform {t.calls:5d} calls {t.elapsed*1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
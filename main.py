@@ -1,11 +1,37 @@
 #!/usr/bin/env python3
-from application import PADAMOReco
-from PyQt6.QtWidgets import QApplication
+import os
 import sys
 
+import startup_profile
+
+PROFILE_FLAG = "--profile-startup"
+
 
 if __name__=="__main__":
+    # Set flag or RECO_PROFILE_STARTUP environment variable to get startup timing report
+    profile = PROFILE_FLAG in sys.argv or bool(os.environ.get("RECO_PROFILE_STARTUP"))
+    if profile:
+        if PROFILE_FLAG in sys.argv:
+            sys.argv.remove(PROFILE_FLAG)
+        startup_profile.start_profiling()
+
+    from PyQt6.QtWidgets import QApplication
+    from PyQt6.QtCore import QTimer
+    from application import PADAMOReco
+    from RecoResources.lazy_module import preload_lazy_modules
+    startup_profile.mark_stage("application imports")
+
+    def on_shown():
+        startup_profile.mark_stage("window shown")
+        if profile:
+            profiler = startup_profile.PROFILER
+            profiler.uninstall()
+            profiler.report()
+        # Heavy modules (pymc, arviz, ...) are loaded while user looks at the window
+        preload_lazy_modules()
+
     app = QApplication(sys.argv)
     main_window = PADAMOReco()
     main_window.show()
+    QTimer.singleShot(0, on_shown)
     app.exec()
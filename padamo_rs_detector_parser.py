@@ -31,9 +31,16 @@ def unit_triangle_integral(f,backend=np):
     return 0.5*backend.sum(quadrature_w*f(quadrature_x,quadrature_y), axis=-1)
 
 
+@static_vars(xs=None,ys=None,ws=None)
+def get_precise_quadrature_rules():
+    if get_precise_quadrature_rules.xs is None:
+        get_precise_quadrature_rules.xs, get_precise_quadrature_rules.ys = np.genfromtxt(os.path.join(BASE_PATH, "quadrature_xy.txt")).T
+        get_precise_quadrature_rules.ws = np.genfromtxt(os.path.join(BASE_PATH, "quadrature_w.txt"))
+    return get_precise_quadrature_rules.xs, get_precise_quadrature_rules.ys, get_precise_quadrature_rules.ws
+
+
 def unit_triangle_integral_array(f,backend=np):
-    quadrature_x, quadrature_y = np.genfromtxt("quadrature_xy.txt").T
-    quadrature_w = np.genfromtxt("quadrature_w.txt")
+    quadrature_x, quadrature_y, quadrature_w = get_precise_quadrature_rules()
     return 0.5*backend.sum(quadrature_w*f(quadrature_x,quadrature_y))
 
 
@@ -46,6 +53,18 @@ def arbitrary_triangle_integral(f,r1:Tuple[float,float],r2:Tuple[float,float],r3
     j = abs((r2[0]-r1[0])*(r3[1]-r1[1]) - (r2[1]-r1[1])*(r3[0]-r1[0]))
     return j*unit_triangle_integral(offset_func,backend=backend)
 
+
+def triangle_quadrature(r1,r2,r3):
+    '''
+    Quadrature nodes and weights of triangle in detector coordinates.
+    Weights include jacobian, so integral is sum(w*f(x,y))
+    '''
+    quadrature_x, quadrature_y, quadrature_w = get_quadrature_rules()
+    x = r1[0] + (r2[0]-r1[0]) * quadrature_x + (r3[0]-r1[0]) * quadrature_y
+    y = r1[1] + (r2[1]-r1[1]) * quadrature_x + (r3[1]-r1[1]) * quadrature_y
+    j = abs((r2[0]-r1[0])*(r3[1]-r1[1]) - (r2[1]-r1[1])*(r3[0]-r1[0]))
+    return x, y, 0.5*j*quadrature_w
+
 class PlotNorm(object):
     def get_minmax(self, data, alive_pixel_matrix):
         raise NotImplementedError
@@ -110,6 +129,8 @@ class PadamoPixel(object):
         self.max_x = np.max(self.vertices[:,0])
         self.min_y = np.min(self.vertices[:,1])
         self.max_y = np.max(self.vertices[:,1])
+        self.center = np.mean(self.vertices, axis=0)
+        self._quadrature = None
 
     def draw_pixel(self,ax:plt.Axes,source_array:np.ndarray,min_,max_,colormap,offset,alive_matrix):
         value = float(source_array[self.index])
@@ -142,6 +163,16 @@ class PadamoPixel(object):
     def triangles(self):
         return earclip_generator(self.vertices)
 
+    def quadrature(self):
+        '''
+        Quadrature nodes and weights covering whole pixel polygon. Computed once.
+        :return: xs, ys, ws flat arrays. Integral of f is sum(ws*f(xs,ys))
+        '''
+        if self._quadrature is None:
+            parts = [triangle_quadrature(*triangle) for triangle in self.triangles()]
+            self._quadrature = tuple(np.concatenate(arrays) for arrays in zip(*parts))
+        return self._quadrature
+
     def position_is_inside(self,point:np.ndarray):
         for a,b,c in self.triangles():
             if point_in_triangle(point,a,b,c):
@@ -250,6 +281,30 @@ class PadamoDetector(object):
     def iterate(self):
         return index_iterator(self.compat_shape)
 
+    def quadrature_table(self, pixels=None):
+        '''
+        Quadrature nodes of several pixels packed into arrays of shape (pixels, nodes).
+        Pixels with fewer nodes are padded with zero weight nodes.
+        Integral over each pixel is sum(ws*f(xs,ys), axis=-1), this works with symbolic f too.
+        :param pixels: pixels to pack, all detector pixels by default
+        :return: xs, ys, ws
+        '''
+        if pixels is None:
+            pixels = self.pixels
+        tables = [pixel.quadrature() for pixel in pixels]
+        n = max(len(table[0]) for table in tables)
+        xs = np.zeros((len(tables), n))
+        ys = np.zeros((len(tables), n))
+        ws = np.zeros((len(tables), n))
+        for i, (x, y, w) in enumerate(tables):
+            xs[i, :len(x)] = x
+            ys[i, :len(y)] = y
+            ws[i, :len(w)] = w
+            # Padding nodes repeat a real node so f stays finite there
+            xs[i, len(x):] = x[0]
+            ys[i, len(y):] = y[0]
+        return xs, ys, ws
+
     def pixel_is_active(self,i):
         return self.alive_pixels[i].any()
 
@@ -0,0 +1,123 @@
+import time
+
+import numpy as np
+
+# Connection-like object (anything with send()) used by worker process to report progress.
+# Stays None in GUI process so reporting is a no-op there.
+CHANNEL = None
+
+
+def set_channel(tx):
+    global CHANNEL
+    CHANNEL = tx
+
+
+def report(kind:str, payload):
+    """
+    Send event to GUI if worker channel is set.
+    :param kind: event kind ("progress", "partial_trace", ...)
+    :param payload: picklable data
+    """
+    if CHANNEL is None:
+        return
+    try:
+        CHANNEL.send((kind, payload))
+    except (OSError, ValueError):
+        # GUI side is gone. Sampling should not fail because of it.
+        pass
+
+
+class SamplingProgress(object):
+    """
+    Callback for pm.sample (pymc NUTS sampler only). Reports per chain draw counts, divergences
+    and elapsed time every `interval` seconds and partial posterior every `partial_interval` seconds.
+    """
+    def __init__(self, draws:int, tune:int, chains:int, interval=0.5, partial_interval=10.0,
+                 max_partial_draws=500, max_var_size=16):
+        self.draws = draws
+        self.tune = tune
+        self.chains = chains
+        self.interval = interval
+        self.partial_interval = partial_interval
+        self.max_partial_draws = max_partial_draws
+        self.max_var_size = max_var_size
+        self.start = time.perf_counter()
+        self.last_report = 0.0
+        self.last_partial = 0.0
+        self.tuned = dict()
+        self.drawn = dict()
+        self.divergences = dict()
+        self.traces = dict()
+
+    def state(self):
+        return dict(
+            elapsed=time.perf_counter()-self.start,
+            draws=self.draws,
+            tune=self.tune,
+            chains=[dict(chain=c,
+                         tuned=self.tuned.get(c, 0),
+                         drawn=self.drawn.get(c, 0),
+                         divergences=self.divergences.get(c, 0))
+                    for c in range(self.chains)],
+        )
+
+    def partial_posterior(self):
+        """
+        Collect post-tuning draws of small variables from chain traces recorded so far.
+        Chains without draws are skipped, chains behind the longest one are padded with NaN.
+        :return: dict varname -> array (chain, draw, *shape) or None if nothing is drawn yet
+        """
+        chains = [c for c in sorted(self.traces.keys()) if self.drawn.get(c, 0) > 0]
+        if not chains:
+            return None
+        n = max(self.drawn[c] for c in chains)
+        step = max(1, n//self.max_partial_draws)
+        length = len(range(0, n, step))
+        posterior = dict()
+        for name in self.traces[chains[0]].varnames:
+            values = [self.traces[c].get_values(name)[self.tune:self.tune+self.drawn[c]:step] for c in chains]
+            if values[0][0].size > self.max_var_size:
+                continue
+            padded = np.full((len(chains), length)+values[0].shape[1:], np.nan)
+            for i, v in enumerate(values):
+                padded[i, :len(v)] = v
+            posterior[name] = padded
+        return posterior
+
+    def __call__(self, trace, draw):
+        chain = draw.chain
+        self.traces[chain] = trace
+        if draw.tuning:
+            self.tuned[chain] = self.tuned.get(chain, 0) + 1
+        else:
+            self.drawn[chain] = self.drawn.get(chain, 0) + 1
+            if any(s.get("diverging", False) for s in draw.stats):
+                self.divergences[chain] = self.divergences.get(chain, 0) + 1
+
+        now = time.perf_counter()-self.start
+        if now - self.last_report >= self.interval or self.drawn.get(chain, 0) == self.draws:
+            self.last_report = now
+            report("progress", self.state())
+        if now - self.last_partial >= self.partial_interval:
+            self.last_partial = now
+            posterior = self.partial_posterior()
+            if posterior is not None:
+                report("partial_trace", posterior)
+
+
+class FitProgress(object):
+    """
+    Callback for pm.fit. Reports iteration and current loss every `interval` seconds.
+    """
+    def __init__(self, n:int, interval=0.5):
+        self.n = n
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last_report = 0.0
+
+    def __call__(self, approx, losses, i):
+        now = time.perf_counter()-self.start
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            loss = float(losses[i-1]) if i > 0 else float("nan")
+            report("progress", dict(elapsed=now, iteration=i, n=self.n, loss=loss))
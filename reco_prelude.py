@@ -3,3 +3,4 @@ from reconstruction_model import ReconsructionModel, Scene, SceneEventResult, La
 from RecoResources import *
 
 from RecoResources.prior_resource import template_uniform, template_normal, template_halfnormal, template_exponent
+from RecoResources.prior_resource import template_circular
@@ -0,0 +1,87 @@
+import builtins
+import sys
+import time
+
+
+class StartupProfiler(object):
+    """
+    Collects import times of modules and durations of startup stages.
+    Wraps builtins.__import__, so only modules imported for the first time are accounted.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.imports = dict()  # module name -> [total, self]
+        self.stages = []
+        self._stack = []
+        self._original_import = None
+        self._last_stage = self.start
+
+    def install(self):
+        if self._original_import is not None:
+            return
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original_import is None:
+            return
+        builtins.__import__ = self._original_import
+        self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level != 0 or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+        start = time.perf_counter()
+        self._stack.append(0.0)
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            nested = self._stack.pop()
+            elapsed = time.perf_counter() - start
+            if self._stack:
+                self._stack[-1] += elapsed
+            if name not in self.imports:
+                self.imports[name] = [elapsed, elapsed - nested]
+
+    def stage(self, name):
+        """
+        Mark end of startup stage
+        """
+        now = time.perf_counter()
+        self.stages.append((name, now - self._last_stage))
+        self._last_stage = now
+
+    def report(self, top=25, file=None):
+        if file is None:
+            file = sys.stdout
+        total = time.perf_counter() - self.start
+        print(f"Startup took {total:.3f} s", file=file)
+        for name, elapsed in self.stages:
+            print(f"  {elapsed:8.3f} s  {name}", file=file)
+        items = sorted(self.imports.items(), key=lambda x: x[1][1], reverse=True)
+        print(f"Slowest imports (self / cumulative, {len(items)} modules imported):", file=file)
+        for name, (cumulative, own) in items[:top]:
+            print(f"  {own:8.3f} s  {cumulative:8.3f} s  {name}", file=file)
+        top_level = dict()
+        for name, (cumulative, own) in self.imports.items():
+            root = name.split(".")[0]
+            top_level[root] = top_level.get(root, 0.0) + own
+        print("Import time by package:", file=file)
+        for root, elapsed in sorted(top_level.items(), key=lambda x: x[1], reverse=True)[:top]:
+            print(f"  {elapsed:8.3f} s  {root}", file=file)
+
+
+PROFILER = None
+
+
+def start_profiling():
+    global PROFILER
+    if PROFILER is None:
+        PROFILER = StartupProfiler()
+        PROFILER.install()
+    return PROFILER
+
+
+def mark_stage(name):
+    if PROFILER is not None:
+        PROFILER.stage(name)
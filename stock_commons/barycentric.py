@@ -0,0 +1,277 @@
+import numpy as np
+
+
+def track_approx(x,b0,b1,b2,a,x0,sd):
+    return b0+b1*x+b2*x**2+a*np.exp(-0.5*((x-x0)/sd)**2)
+
+
+def trunc_track_approx(x,a,x0,sd):
+    return a*np.exp(-0.5*((x-x0)/sd)**2)
+
+
+# Defaults of MINPACK used by curve_fit
+LM_FTOL = 1.49012e-08
+LM_XTOL = 1.49012e-08
+# Bound of jacobian elements held at once by batched fit
+LM_CHUNK_ELEMENTS = 2**24
+
+
+def track_approx_jacobian(x,b0,b1,b2,a,x0,sd):
+    '''
+    Derivatives of track_approx by (b0, b1, b2, a, x0, sd), stacked along last axis
+    '''
+    z = (x-x0)/sd
+    g = np.exp(-0.5*z**2)
+    ones = np.ones_like(g)
+    return np.stack([ones, x*ones, x**2*ones, g, a*g*z/sd, a*g*z**2/sd], axis=-1)
+
+
+def _batch_residuals(xdata, ydata, params):
+    return ydata-track_approx(xdata, *params.T[:, :, None])
+
+
+def _batch_solve(matrices, vectors):
+    try:
+        return np.linalg.solve(matrices, vectors[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.einsum("kpq,kq->kp", np.linalg.pinv(matrices), vectors)
+
+
+def _fit_pixels_block(xdata, ydata, max_iter, ftol, xtol):
+    n, m = ydata.shape
+    params = np.zeros((n, 6))
+    params[:, 3] = np.max(ydata, axis=1)
+    params[:, 4] = np.argmax(ydata, axis=1)
+    params[:, 5] = 1.0
+    residuals = _batch_residuals(xdata, ydata, params)
+    cost = np.sum(residuals**2, axis=1)
+    damping = np.full(n, 1e-3)
+    done = np.zeros(n, dtype=bool)
+    converged = np.zeros(n, dtype=bool)
+    diag_index = np.arange(6)
+
+    for _ in range(max_iter):
+        ids = np.flatnonzero(~done)
+        if len(ids) == 0:
+            break
+        p = params[ids]
+        jac = track_approx_jacobian(xdata, *p.T[:, :, None])
+        jtj = np.einsum("ktp,ktq->kpq", jac, jac)
+        jtr = np.einsum("ktp,kt->kp", jac, residuals[ids])
+        # Marquardt scaling, keeps background polynomial and pulse parameters comparable
+        scale = np.diagonal(jtj, axis1=1, axis2=2)
+        scale = np.maximum(scale, 1e-12*np.max(scale, axis=1, keepdims=True))
+        lhs = jtj.copy()
+        lhs[:, diag_index, diag_index] += damping[ids, None]*scale
+        step = _batch_solve(lhs, jtr)
+
+        new_p = p+step
+        new_residuals = _batch_residuals(xdata, ydata[ids], new_p)
+        new_cost = np.sum(new_residuals**2, axis=1)
+        improved = np.isfinite(new_cost) & (new_cost < cost[ids])
+
+        small_cost = cost[ids]-new_cost <= ftol*cost[ids]
+        step_norm = np.linalg.norm(step, axis=1)
+        small_step = step_norm <= xtol*(np.linalg.norm(p, axis=1)+xtol)
+        # Tiny step counts as convergence only if it is accepted or rejected with little damping
+        # (then even Gauss-Newton step does not move the point); growing damping shrinks any step
+        at_minimum = ~improved & small_step & (damping[ids] <= 1.0)
+        finished = (improved & (small_cost | small_step)) | at_minimum | (cost[ids] == 0.0)
+        # Step is rejected for any damping: iterations are stuck, report failure
+        stuck = ~finished & (damping[ids] > 1e16)
+
+        accepted = ids[improved]
+        params[accepted] = new_p[improved]
+        residuals[accepted] = new_residuals[improved]
+        cost[accepted] = new_cost[improved]
+        damping[accepted] /= 10.0
+        damping[ids[~improved]] *= 10.0
+        done[ids[finished | stuck]] = True
+        converged[ids[finished]] = True
+
+    # Covariance as in curve_fit: inverse of J^T J scaled by residual variance
+    jac = track_approx_jacobian(xdata, *params.T[:, :, None])
+    jtj = np.einsum("ktp,ktq->kpq", jac, jac)
+    perr = np.full((n, 6), np.inf)
+    if m > 6:
+        regular = np.linalg.matrix_rank(jtj) == 6
+        if regular.any():
+            pcov = np.linalg.pinv(jtj[regular])*(cost[regular]/(m-6))[:, None, None]
+            perr[regular] = np.sqrt(np.abs(np.diagonal(pcov, axis1=1, axis2=2)))
+    return params, perr, converged
+
+
+def fit_pixels(xdata, ydata, max_iter=200, ftol=LM_FTOL, xtol=LM_XTOL):
+    '''
+    Fit track_approx to many light curves at once with batched Levenberg-Marquardt iterations.
+    Initial guess is zero background with peak at maximum, covariance is scaled by residual variance as in curve_fit.
+    :param xdata: frame numbers (T,)
+    :param ydata: light curves (N, T)
+    :return: popt (N, 6), perr (N, 6) (inf if covariance is undefined), converged (N,) flags
+    '''
+    xdata = np.asarray(xdata, dtype=float)
+    ydata = np.asarray(ydata, dtype=float)
+    n = ydata.shape[0]
+    block = max(1, LM_CHUNK_ELEMENTS//(6*max(ydata.shape[1], 1)))
+    popt = np.zeros((n, 6))
+    perr = np.zeros((n, 6))
+    converged = np.zeros(n, dtype=bool)
+    for start in range(0, n, block):
+        s = slice(start, start+block)
+        popt[s], perr[s], converged[s] = _fit_pixels_block(xdata, ydata[s], max_iter, ftol, xtol)
+    return popt, perr, converged
+
+
+def pixel_series(reco_data, indices):
+    '''
+    Light curves of pixels as array (N, T)
+    '''
+    if not indices:
+        return np.zeros((0, reco_data.shape[0]))
+    s = (slice(None),) + tuple(np.array(indices).T)
+    return np.asarray(reco_data[s]).T
+
+
+def fit_active_pixels(reco_data, detector):
+    '''
+    Fit light curve of each active pixel with track_approx
+    :param reco_data: signal array (time, *pixel index)
+    :param detector: detector with selected active pixels
+    :return: dict pixel index -> fitted parameters (b0, b1, b2, a, x0, sd)
+    '''
+    pixel_activations = dict()
+    xdata = np.arange(reco_data.shape[0])
+    indices = [i for i in detector.iterate() if detector.pixel_is_active(i)]
+    popt, perr, converged = fit_pixels(xdata, pixel_series(reco_data, indices))
+    for i, params, ok in zip(indices, popt, converged):
+        if ok:
+            pixel_activations[i] = params
+            print(f"Pixel {i} is active in interval {pixel_activations[i]}")
+        else:
+            print("No convergence...")
+    return pixel_activations
+
+
+def barycenter_trajectory(reco_data, detector, pixel_activations, use_real=False):
+    '''
+    Signal weighted center of active pixels for each frame where any of fitted pulses is present (within 3 sigma)
+    :param use_real: use background subtracted signal instead of fitted pulse as weight
+    :return: array (N, 3) of rows [t, x, y]
+    '''
+    pixels = [pixel for pixel in detector.pixels
+              if detector.pixel_is_active(pixel.index) and pixel.index in pixel_activations.keys()]
+    if not pixels:
+        return np.array([])
+    centers = np.array([pixel.center for pixel in pixels])
+    b0, b1, b2, a, x0, sd = np.array([pixel_activations[pixel.index] for pixel in pixels]).T
+    t_start = x0-3*sd
+    t_end = x0+3*sd
+
+    # Only frames covered by some pulse can have signal
+    first = max(int(np.ceil(np.min(t_start))), 0)
+    last = min(int(np.floor(np.max(t_end))), reco_data.shape[0]-1)
+    if first > last:
+        return np.array([])
+    t = np.arange(first, last+1)[:, None]
+
+    inside = (t_start <= t) & (t <= t_end)
+    if use_real:
+        s = (slice(first, last+1),) + tuple(np.array([pixel.index for pixel in pixels]).T)
+        signal = reco_data[s].astype(float) - (b0+b1*t+b2*t**2)
+    else:
+        signal = a*np.exp(-0.5*((t-x0)/sd)**2)
+    # (T, N) weights of pixels in each frame
+    weights = np.where(inside, signal, 0.0)
+
+    xy_sum = np.sum(weights, axis=1)
+    xy = weights @ centers
+    nonzero = xy_sum != 0
+    xy[nonzero] /= xy_sum[nonzero, None]
+    has_signal = inside.any(axis=1)
+    return np.column_stack([t[:, 0], xy])[has_signal]
+
+
+def fit_linear_motion(trajectory, robust=False):
+    '''
+    Fit x(t) = kx*t+bx and y(t) = ky*t+by to barycenter trajectory
+    :return: (kx, bx), (ky, by). Pair is None if fit did not converge
+    '''
+    # scipy is slow to import, keep it out of application start
+    from scipy.optimize import curve_fit
+
+    def linreg(x,k,b):
+        return k*x+b
+
+    if robust:
+        used_loss = "soft_l1"
+    else:
+        used_loss = "linear"
+
+    def mod_fit(axis):
+        try:
+            popt,pcov = curve_fit(linreg,trajectory[:,0],trajectory[:,axis],p0=np.array([1.0,0.0]),
+                                  method="dogbox", loss=used_loss)
+            return tuple(popt)
+        except RuntimeError:
+            return None
+
+    return mod_fit(1), mod_fit(2)
+
+
+def estimate_linear_track(reco_data, detector, use_real=False, robust=False):
+    '''
+    Fast barycentric estimate of linear track parameters
+    :param reco_data: signal array (time, *pixel index). Time is counted from its first frame
+    :return: dict with trajectory, kx, bx, ky, by, u0 [mm/frame] and phi [deg]. Velocity values are missing
+    if trajectory is too short to fit
+    '''
+    pixel_activations = fit_active_pixels(reco_data, detector)
+    trajectory = barycenter_trajectory(reco_data, detector, pixel_activations, use_real)
+    result = dict(trajectory=trajectory)
+    if len(trajectory) < 2:
+        return result
+    fit_x, fit_y = fit_linear_motion(trajectory, robust)
+    if fit_x is None or fit_y is None:
+        return result
+    kx, bx = fit_x
+    ky, by = fit_y
+    result.update(kx=kx, bx=bx, ky=ky, by=by, u0=(kx**2+ky**2)**0.5, phi=np.arctan2(ky,kx)*180/np.pi)
+    return result
+
+
+def pixels_near_trajectory(pixels, xs, ys, distance):
+    '''
+    Check which pixels are close to trajectory
+    :param pixels: detector pixels
+    :param xs, ys: trajectory points
+    :param distance: max distance from pixel bounding box to nearest trajectory point
+    :return: boolean array, one value per pixel
+    '''
+    near = np.zeros(len(pixels), dtype=bool)
+    for i, pixel in enumerate(pixels):
+        min_x, max_x, min_y, max_y = pixel.get_bounds()
+        dx = np.maximum(np.maximum(min_x-xs, xs-max_x), 0.0)
+        dy = np.maximum(np.maximum(min_y-ys, ys-max_y), 0.0)
+        near[i] = np.min(dx**2+dy**2) <= distance**2
+    return near
+
+
+def detect_signal_window(light_curve, threshold=5.0, padding=5, smoothing=1):
+    '''
+    Find frames containing signal in summed light curve of active pixels
+    :param light_curve: summed signal for each frame
+    :param threshold: detection threshold in robust (MAD based) noise sigmas above median
+    :param padding: frames added to both sides of detected interval
+    :param smoothing: moving average window applied before detection
+    :return: (start, end) frame interval relative to light curve start, None if no signal is detected
+    '''
+    smoothing = max(1, smoothing)
+    smoothed = np.convolve(light_curve, np.ones(smoothing)/smoothing, mode="same")
+    median = np.median(smoothed)
+    noise = 1.4826*np.median(np.abs(smoothed-median))
+    detected = np.flatnonzero(smoothed > median+threshold*noise)
+    if len(detected) == 0:
+        return None
+    start = max(detected[0]-padding, 0)
+    end = min(detected[-1]+padding+1, len(light_curve))
+    return start, end
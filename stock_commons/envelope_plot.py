@@ -0,0 +1,82 @@
+import numpy as np
+from matplotlib import pyplot as plt
+
+from RecoResources.hdf5_data import EnvelopePyramid
+
+# Used if axes size is unknown
+DEFAULT_BINS = 2000
+
+
+def envelope_xy(xs, lower, upper):
+    '''
+    Polyline through min and max of each bin. At full resolution this is plain series.
+    '''
+    if lower is upper:
+        return xs, lower
+    return np.repeat(xs, 2), np.stack([lower, upper], axis=1).reshape(-1)
+
+
+def view_bins(axes: plt.Axes):
+    # About one bin per screen pixel
+    width = axes.get_window_extent().width
+    if width <= 0:
+        return DEFAULT_BINS
+    return int(width)
+
+
+def band_xy(pyramid: EnvelopePyramid, upper_index, lower_index, start, stop, bins):
+    '''
+    Polygon covering area between two series of same pyramid (between upper series and zero if lower_index is None)
+    '''
+    xs, _, top = pyramid.view(upper_index, start, stop, bins)
+    if lower_index is None:
+        bottom = np.zeros_like(top)
+    else:
+        _, bottom, _ = pyramid.view(lower_index, start, stop, bins)
+    return np.concatenate([xs, xs[::-1]]), np.concatenate([top, bottom[::-1]])
+
+
+class EnvelopePlot(object):
+    '''
+    Lines and bands of several series drawn from envelope pyramids.
+    They are refined for visible frame range whenever x limits of axes change.
+    '''
+    def __init__(self, axes: plt.Axes):
+        self.axes = axes
+        # Functions (start, stop, bins) updating artists
+        self.updaters = []
+        # Registry keeps only weak references to bound methods, lambda keeps this object alive with axes
+        axes.callbacks.connect("xlim_changed", lambda ax: self.on_xlim_changed(ax))
+
+    def plot(self, pyramid: EnvelopePyramid, index=(), **kwargs):
+        xs, lower, upper = pyramid.view(index, 0, len(pyramid), view_bins(self.axes))
+        line, = self.axes.plot(*envelope_xy(xs, lower, upper), **kwargs)
+
+        def update(start, stop, bins):
+            line.set_data(*envelope_xy(*pyramid.view(index, start, stop, bins)))
+
+        self.updaters.append(update)
+        return line
+
+    def fill(self, pyramid: EnvelopePyramid, upper_index, lower_index=None, **kwargs):
+        xs, ys = band_xy(pyramid, upper_index, lower_index, 0, len(pyramid), view_bins(self.axes))
+        polygon, = self.axes.fill(xs, ys, **kwargs)
+
+        def update(start, stop, bins):
+            polygon.set_xy(np.column_stack(band_xy(pyramid, upper_index, lower_index, start, stop, bins)))
+
+        self.updaters.append(update)
+        return polygon
+
+    def refine(self):
+        start, stop = sorted(self.axes.get_xlim())
+        # One view width of margin on each side keeps panning smooth
+        width = stop-start
+        start, stop = start-width, stop+width
+        bins = 3*view_bins(self.axes)
+        for update in self.updaters:
+            update(start, stop, bins)
+
+    def on_xlim_changed(self, axes):
+        self.refine()
+        axes.figure.canvas.draw_idle()
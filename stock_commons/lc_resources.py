@@ -1,11 +1,13 @@
 import numpy as np
-import pymc as pm
-import pytensor.tensor as pt
 from matplotlib.axes import Axes
 
 from reco_prelude import AlternatingResource, DistributionResource, ResourceVariant, CombineResource, ResourceRequest
 from reco_prelude import BlankResource
 from RecoResources.prior_resource import template_exponent, template_uniform
+from RecoResources.lazy_module import lazy_import
+
+pm = lazy_import("pymc")
+pt = lazy_import("pytensor.tensor")
 
 
 def estimate(trace,key):
@@ -136,8 +138,14 @@ class MainLC(CombineResource):
         "e0":dict(display_name="E0", type_=DistributionResource, default_value=template_uniform(10.0,60.0)),
     })
 
+    def make_profile(self,x):
+        """
+        Light curve without E0 factor
+        """
+        return self.data.get_resource("lc").make_lc("lc",x)
+
     def make_lc(self,x):
-        profile = self.data.get_resource("lc").make_lc("lc",x)
+        profile = self.make_profile(x)
         e0 = self.data.get_resource("e0").create_distribution("e0")
         return e0*profile
 
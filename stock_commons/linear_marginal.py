@@ -0,0 +1,42 @@
+import numpy as np
+from RecoResources.lazy_module import lazy_import
+
+pm = lazy_import("pymc")
+pt = lazy_import("pytensor.tensor")
+
+# Std of weak zero mean prior on marginalized amplitudes
+AMPLITUDE_PRIOR_SIGMA = 1e4
+
+
+def marginal_gaussian_amplitudes(name, templates, observed, sigma, amplitude_names, prior_sigma=AMPLITUDE_PRIOR_SIGMA):
+    '''
+    Gaussian likelihood of observed ~ N(sum_i a_i*templates[i], sigma) with linear amplitudes a_i
+    integrated out in closed form under weak prior a_i ~ N(0, prior_sigma).
+    Prior keeps the Gram matrix positive definite when some template vanishes
+    (e.g. star below horizon in every frame), amplitude of such template is left at prior.
+    Amplitudes are recovered as deterministics (their conditional posterior mean).
+    :param name: name of likelihood potential
+    :param templates: list of tensors with shape of observed, one per amplitude
+    :param observed: observed data, 1D array
+    :param sigma: noise std, scalar or tensor broadcastable to observed
+    :param amplitude_names: names of amplitude deterministics, None to skip deterministic
+    :param prior_sigma: std of amplitude prior, large compared to expected amplitudes
+    :return: tensor of conditional posterior mean amplitudes
+    '''
+    k = len(templates)
+    g = pt.stack(templates)
+    w = pt.ones_like(g[0])/sigma**2
+    precision = pt.dot(g*w, g.T) + pt.eye(k)/prior_sigma**2
+    projection = pt.dot(g*w, observed)
+    chol = pt.linalg.cholesky(precision)
+    z = pt.linalg.solve_triangular(chol, projection, lower=True)
+    amplitudes = pt.linalg.solve_triangular(chol.T, z, lower=False)
+    for i, amplitude_name in enumerate(amplitude_names):
+        if amplitude_name is not None:
+            pm.Deterministic(amplitude_name, amplitudes[i])
+    residual = pt.sum(w*observed**2) - pt.dot(z, z)
+    logdet = 2*pt.sum(pt.log(pt.diag(chol)))
+    logp = (-0.5*residual + 0.5*pt.sum(pt.log(w)) - 0.5*logdet - k*np.log(prior_sigma)
+            - 0.5*observed.shape[0]*np.log(2*np.pi))
+    pm.Potential(name, logp)
+    return amplitudes
@@ -1,17 +1,19 @@
 import numpy as np
-import pytensor.tensor
 
 from RecoResources import CombineResource, AlternatingResource, ResourceRequest, ResourceVariant
 from RecoResources.prior_resource import template_normal, DistributionResource
 from transform import Quaternion
 from transform.astronomy import ecef_align
+from RecoResources.lazy_module import lazy_import
+
+pt = lazy_import("pytensor.tensor")
 
 
 def equatorial(dec,ha,rot):
     if isinstance(dec, float):
         backend = np
     else:
-        backend = pytensor.tensor
+        backend = pt
     return ecef_align(dec,ha,rot,backend)
 
 
@@ -19,7 +21,7 @@ def local_data(elevation, azimuth, rot):
     if isinstance(elevation, float):
         backend = np
     else:
-        backend = pytensor.tensor
+        backend = pt
     own_rot = Quaternion.rotate_zx(rot,backend)
     az_rot = Quaternion.rotate_yx(azimuth,backend)
     elev_rot = Quaternion.rotate_yz(elevation,backend)
@@ -0,0 +1,244 @@
+import math
+
+import numpy as np
+from RecoResources.lazy_module import lazy_import
+
+nb = lazy_import("numba")
+pt = lazy_import("pytensor.tensor")
+
+SQRT2 = math.sqrt(2.0)
+SQRT2PI = math.sqrt(2.0*math.pi)
+
+
+def _pixel_gaussian(min_x, max_x, min_y, max_y, x, y, sigma):
+    res = np.empty(x.shape[0])
+    for i in range(x.shape[0]):
+        scale = sigma[i]*SQRT2
+        ex = math.erf((max_x[i]-x[i])/scale)-math.erf((min_x[i]-x[i])/scale)
+        ey = math.erf((max_y[i]-y[i])/scale)-math.erf((min_y[i]-y[i])/scale)
+        res[i] = ex*ey/4.0
+    return res
+
+
+def _pixel_gaussian_grad(min_x, max_x, min_y, max_y, x, y, sigma, gz):
+    n = x.shape[0]
+    dx = np.empty(n)
+    dy = np.empty(n)
+    dsigma = np.empty(n)
+    for i in range(n):
+        s = sigma[i]
+        scale = s*SQRT2
+        norm = 1.0/(s*SQRT2PI)
+        ax = min_x[i]-x[i]
+        bx = max_x[i]-x[i]
+        ay = min_y[i]-y[i]
+        by = max_y[i]-y[i]
+        ex = (math.erf(bx/scale)-math.erf(ax/scale))/2.0
+        ey = (math.erf(by/scale)-math.erf(ay/scale))/2.0
+        # Gaussian density at pixel edges
+        nax = norm*math.exp(-ax*ax/(2*s*s))
+        nbx = norm*math.exp(-bx*bx/(2*s*s))
+        nay = norm*math.exp(-ay*ay/(2*s*s))
+        nby = norm*math.exp(-by*by/(2*s*s))
+        dx[i] = gz[i]*(nax-nbx)*ey
+        dy[i] = gz[i]*ex*(nay-nby)
+        dsigma[i] = gz[i]*((ax*nax-bx*nbx)*ey+ex*(ay*nay-by*nby))/s
+    return dx, dy, dsigma
+
+
+def _pixel_gaussian_formula(min_x, max_x, min_y, max_y, x, y, sigma, erf):
+    scale = sigma*SQRT2
+    ex = erf((max_x-x)/scale)-erf((min_x-x)/scale)
+    ey = erf((max_y-y)/scale)-erf((min_y-y)/scale)
+    return ex*ey/4.0
+
+
+def _pixel_gaussian_grad_formula(min_x, max_x, min_y, max_y, x, y, sigma, gz, exp, erf):
+    # Same as _pixel_gaussian_grad, written with array operations of given backend
+    scale = sigma*SQRT2
+    norm = 1.0/(sigma*SQRT2PI)
+    ax = min_x-x
+    bx = max_x-x
+    ay = min_y-y
+    by = max_y-y
+    ex = (erf(bx/scale)-erf(ax/scale))/2.0
+    ey = (erf(by/scale)-erf(ay/scale))/2.0
+    nax = norm*exp(-ax*ax/(2*sigma*sigma))
+    nbx = norm*exp(-bx*bx/(2*sigma*sigma))
+    nay = norm*exp(-ay*ay/(2*sigma*sigma))
+    nby = norm*exp(-by*by/(2*sigma*sigma))
+    dx = gz*(nax-nbx)*ey
+    dy = gz*ex*(nay-nby)
+    dsigma = gz*((ax*nax-bx*nbx)*ey+ex*(ay*nay-by*nby))/sigma
+    return dx, dy, dsigma
+
+
+def _flat_inputs(inputs):
+    return [np.ascontiguousarray(v, dtype=np.float64).ravel() for v in inputs]
+
+
+_PIXEL_GAUSSIAN_OP = None
+
+
+def get_pixel_gaussian_op():
+    '''
+    Op is built on first use: numba and pytensor graph modules are heavy to import on application start.
+    '''
+    global _PIXEL_GAUSSIAN_OP
+    if _PIXEL_GAUSSIAN_OP is not None:
+        return _PIXEL_GAUSSIAN_OP
+
+    from pytensor.gradient import disconnected_type, DisconnectedType, grad
+    from pytensor.graph.basic import Apply
+    from pytensor.graph.replace import clone_replace
+    from pytensor.graph.op import Op
+    from pytensor.scalar import upcast
+
+    pixel_gaussian_kernel = nb.njit(cache=True)(_pixel_gaussian)
+    pixel_gaussian_grad_kernel = nb.njit(cache=True)(_pixel_gaussian_grad)
+
+    class PixelGaussianGradOp(Op):
+        '''
+        Gradient of PixelGaussianOp by x, y and sigma multiplied by output gradient
+        '''
+        __props__ = ()
+
+        def make_node(self, *inputs):
+            inputs = [pt.as_tensor_variable(v) for v in inputs]
+            out_dtype = upcast(*[v.dtype for v in inputs[4:]])
+            outputs = [pt.tensor(dtype=out_dtype, shape=inputs[4].type.shape) for _ in range(3)]
+            return Apply(self, inputs, outputs)
+
+        def perform(self, node, inputs, output_storage):
+            shape = np.shape(inputs[4])
+            grads = pixel_gaussian_grad_kernel(*_flat_inputs(inputs))
+            for storage, grad, out in zip(output_storage, grads, node.outputs):
+                storage[0] = grad.reshape(shape).astype(out.dtype)
+
+        def infer_shape(self, fgraph, node, shapes):
+            return [shapes[4]]*3
+
+        def grad(self, inputs, output_grads):
+            # Second derivatives (e.g. Hessian at mode) are rare, symbolic formula is enough there
+            # Formula is built on independent copies of inputs: gz usually depends on x, y, sigma itself
+            # and this dependence must not be counted here
+            copies = [v.type() for v in inputs]
+            outputs = _pixel_gaussian_grad_formula(*copies, exp=pt.exp, erf=pt.erf)
+            known = {out: g for out, g in zip(outputs, output_grads) if not isinstance(g.type, DisconnectedType)}
+            if not known:
+                return [pt.zeros_like(v) for v in inputs]
+            grads = grad(None, wrt=copies, known_grads=known, disconnected_inputs="ignore",
+                         return_disconnected="zero")
+            return clone_replace(grads, replace=dict(zip(copies, inputs)))
+
+    class PixelGaussianOp(Op):
+        '''
+        Integral of 2D normal distribution with center (x, y) and std sigma over pixel rectangle
+        [min_x, max_x]x[min_y, max_y]. All inputs must have same shape (see pixel_gaussian).
+        '''
+        __props__ = ()
+
+        def make_node(self, min_x, max_x, min_y, max_y, x, y, sigma):
+            inputs = [pt.as_tensor_variable(v) for v in (min_x, max_x, min_y, max_y, x, y, sigma)]
+            out_dtype = upcast(*[v.dtype for v in inputs[4:]])
+            return Apply(self, inputs, [pt.tensor(dtype=out_dtype, shape=inputs[4].type.shape)])
+
+        def perform(self, node, inputs, output_storage):
+            res = pixel_gaussian_kernel(*_flat_inputs(inputs))
+            output_storage[0][0] = res.reshape(np.shape(inputs[4])).astype(node.outputs[0].dtype)
+
+        def infer_shape(self, fgraph, node, shapes):
+            return [shapes[4]]
+
+        def connection_pattern(self, node):
+            # Pixel bounds are geometry constants
+            return [[False]]*4+[[True]]*3
+
+        def grad(self, inputs, output_grads):
+            dx, dy, dsigma = PixelGaussianGradOp()(*inputs, output_grads[0])
+            return [disconnected_type() for _ in range(4)]+[dx, dy, dsigma]
+
+    register_backends(PixelGaussianOp, PixelGaussianGradOp, pixel_gaussian_kernel, pixel_gaussian_grad_kernel)
+    _PIXEL_GAUSSIAN_OP = PixelGaussianOp()
+    return _PIXEL_GAUSSIAN_OP
+
+
+def register_backends(forward_op, grad_op, forward_kernel, grad_kernel):
+    '''
+    Implementations of PSF Ops for compiled backends used by external samplers:
+    numba (nutpie, numba mode) and JAX (numpyro, blackjax)
+    '''
+    from pytensor.link.numba.dispatch import numba_funcify
+
+    @numba_funcify.register(forward_op)
+    def numba_funcify_pixel_gaussian(op, node=None, **kwargs):
+        @nb.njit
+        def pixel_gaussian_numba(min_x, max_x, min_y, max_y, x, y, sigma):
+            res = forward_kernel(np.ascontiguousarray(min_x).ravel(), np.ascontiguousarray(max_x).ravel(),
+                                 np.ascontiguousarray(min_y).ravel(), np.ascontiguousarray(max_y).ravel(),
+                                 np.ascontiguousarray(x).ravel(), np.ascontiguousarray(y).ravel(),
+                                 np.ascontiguousarray(sigma).ravel())
+            return res.reshape(x.shape).astype(x.dtype)
+        return pixel_gaussian_numba
+
+    @numba_funcify.register(grad_op)
+    def numba_funcify_pixel_gaussian_grad(op, node=None, **kwargs):
+        @nb.njit
+        def pixel_gaussian_grad_numba(min_x, max_x, min_y, max_y, x, y, sigma, gz):
+            dx, dy, dsigma = grad_kernel(np.ascontiguousarray(min_x).ravel(), np.ascontiguousarray(max_x).ravel(),
+                                         np.ascontiguousarray(min_y).ravel(), np.ascontiguousarray(max_y).ravel(),
+                                         np.ascontiguousarray(x).ravel(), np.ascontiguousarray(y).ravel(),
+                                         np.ascontiguousarray(sigma).ravel(), np.ascontiguousarray(gz).ravel())
+            return (dx.reshape(x.shape).astype(x.dtype), dy.reshape(x.shape).astype(x.dtype),
+                    dsigma.reshape(x.shape).astype(x.dtype))
+        return pixel_gaussian_grad_numba
+
+    try:
+        from pytensor.link.jax.dispatch import jax_funcify
+    except ImportError:
+        # JAX samplers are not available anyway
+        return
+
+    @jax_funcify.register(forward_op)
+    def jax_funcify_pixel_gaussian(op, **kwargs):
+        from jax.scipy.special import erf
+
+        def pixel_gaussian_jax(*inputs):
+            return _pixel_gaussian_formula(*inputs, erf=erf)
+        return pixel_gaussian_jax
+
+    @jax_funcify.register(grad_op)
+    def jax_funcify_pixel_gaussian_grad(op, **kwargs):
+        import jax.numpy as jnp
+        from jax.scipy.special import erf
+
+        def pixel_gaussian_grad_jax(*inputs):
+            return _pixel_gaussian_grad_formula(*inputs, exp=jnp.exp, erf=erf)
+        return pixel_gaussian_grad_jax
+
+
+def pixel_gaussian(min_x, max_x, min_y, max_y, x, y, sigma):
+    '''
+    Pixel response to gaussian PSF, product of erf differences along x and y,
+    evaluated by one compiled node with analytic gradient.
+    :param min_x, max_x, min_y, max_y: pixel bounds
+    :param x, y: PSF center
+    :param sigma: PSF std
+    :return: tensor of broadcast shape of inputs
+    '''
+    inputs = pt.broadcast_arrays(*[pt.as_tensor_variable(v) for v in (min_x, max_x, min_y, max_y, x, y, sigma)])
+    return get_pixel_gaussian_op()(*inputs)
+
+
+def pixel_gaussian_quadrature(xs, ys, ws, x, y, sigma):
+    '''
+    Pixel response to gaussian PSF for pixels of arbitrary shape (see PadamoDetector.quadrature_table).
+    :param xs, ys, ws: quadrature table with shape (pixels, nodes)
+    :param x, y: PSF center, tensors with shape (frames,)
+    :param sigma: PSF std
+    :return: tensor with shape (frames, pixels)
+    '''
+    dx = xs-x[:, None, None]
+    dy = ys-y[:, None, None]
+    density = pt.exp(-(dx**2+dy**2)/(2*sigma**2))/(2*np.pi*sigma**2)
+    return pt.sum(ws*density, axis=-1)
@@ -1,6 +1,17 @@
-import pymc as pm
+import hashlib
+import json
+import os
+
+import numpy as np
 
 from RecoResources import CombineResource, ChoiceResource, ResourceRequest, AlternatingResource, ResourceVariant
+from RecoResources import OptionResource
+from RecoResources.lazy_module import lazy_import
+from progress_report import SamplingProgress, FitProgress
+import workspace
+
+pm = lazy_import("pymc")
+az = lazy_import("arviz")
 
 
 class NUTSSamplerResource(ChoiceResource):
@@ -11,6 +22,200 @@ class NUTSSamplerResource(ChoiceResource):
         "numpyro":"NumPyro (pytorch based)"
     }
 
+class PrecisionResource(ChoiceResource):
+    Choices = {
+        "float64": "Double (float64)",
+        "float32": "Single (float32)",
+    }
+
+
+def cast_trace(trace, dtype):
+    """
+    Cast floating point variables of trace to given dtype. Original trace is kept if convergence diagnostics change.
+    :param dtype: target dtype. None or float64 keeps trace as is
+    """
+    if dtype is None or dtype == "float64":
+        return trace
+    cast = trace.map(lambda ds: ds.map(lambda v: v.astype(dtype) if v.dtype.kind == "f" else v))
+    columns = ["ess_bulk", "ess_tail", "r_hat"]
+    before = az.summary(trace, kind="diagnostics")[columns].to_numpy()
+    after = az.summary(cast, kind="diagnostics")[columns].to_numpy()
+    if not np.allclose(before, after, rtol=0.01, atol=1e-3, equal_nan=True):
+        print(f"Convergence diagnostics change in {dtype}. Trace is kept in original precision")
+        return trace
+    return cast
+
+
+def set_initvals(model, values:dict):
+    """
+    Set initial values of model free variables. Values of unknown variables, non free variables
+    and values outside of variable support are skipped.
+    :return: dict of accepted values
+    """
+    free = {rv.name: rv for rv in model.free_RVs}
+    accepted = dict()
+    for name, value in values.items():
+        if name in free.keys() and np.all(np.isfinite(value)):
+            model.set_initval(free[name], value)
+            accepted[name] = value
+    logps = model.point_logps()
+    for name in list(accepted.keys()):
+        if not np.isfinite(logps.get(name, 0.0)):
+            print(f"Initial value {name}={accepted[name]} is outside of prior support. Skipping")
+            model.set_initval(free[name], None)
+            del accepted[name]
+    return accepted
+
+
+class ConvergenceTargetsResource(CombineResource):
+    Fields = ResourceRequest({
+        "rhat": dict(display_name="Max R-hat", default_value=1.01),
+        "ess_bulk": dict(display_name="Min bulk ESS", default_value=400),
+        "ess_tail": dict(display_name="Min tail ESS", default_value=400),
+        "check_every": dict(display_name="Check every N draws", default_value=250),
+        "max_draws": dict(display_name="Max draws", default_value=10000),
+    })
+
+
+class ConvergenceTargetsOption(OptionResource):
+    OptionType = ConvergenceTargetsResource
+
+
+class ConvergenceStop(object):
+    """
+    pm.sample callback. Checks R-hat and ESS of free variables every `check_every` draws (counted on slowest chain)
+    and interrupts sampling when all targets are met. PyMC keeps draws made before interruption.
+    Chains must be sampled in parallel: sequential chains can be compared only when last one runs.
+    """
+    def __init__(self, targets, tune:int, chains:int, var_names, inner=None):
+        self.rhat = targets.get("rhat")
+        self.ess_bulk = targets.get("ess_bulk")
+        self.ess_tail = targets.get("ess_tail")
+        self.check_every = max(1, targets.get("check_every"))
+        self.tune = tune
+        self.chains = chains
+        self.var_names = var_names
+        self.inner = inner
+        self.traces = dict()
+        self.drawn = dict()
+        self.next_check = self.check_every
+
+    def diagnostics(self, n:int):
+        posterior = dict()
+        for name in self.var_names:
+            posterior[name] = np.stack([self.traces[c].get_values(name)[self.tune:self.tune+n]
+                                        for c in range(self.chains)])
+        dataset = az.convert_to_dataset(posterior)
+        rhat = max(float(az.rhat(dataset)[k].max()) for k in self.var_names)
+        ess_bulk = min(float(az.ess(dataset, method="bulk")[k].min()) for k in self.var_names)
+        ess_tail = min(float(az.ess(dataset, method="tail")[k].min()) for k in self.var_names)
+        return rhat, ess_bulk, ess_tail
+
+    def __call__(self, trace, draw):
+        if self.inner is not None:
+            self.inner(trace, draw)
+        self.traces[draw.chain] = trace
+        if draw.tuning:
+            return
+        self.drawn[draw.chain] = self.drawn.get(draw.chain, 0) + 1
+        n = min(self.drawn.get(c, 0) for c in range(self.chains))
+        if n < self.next_check:
+            return
+        self.next_check = n + self.check_every
+        rhat, ess_bulk, ess_tail = self.diagnostics(n)
+        print(f"Convergence check at {n} draws: R-hat {rhat:.4f}, bulk ESS {ess_bulk:.0f}, tail ESS {ess_tail:.0f}")
+        if rhat <= self.rhat and ess_bulk >= self.ess_bulk and ess_tail >= self.ess_tail:
+            print("Convergence targets are met. Stopping sampling")
+            raise KeyboardInterrupt
+
+
+class AdaptationReuseResource(ChoiceResource):
+    Choices = {
+        "off": "Adapt from scratch",
+        "export": "Save adapted state",
+        "reuse": "Start from saved state and save new one",
+    }
+
+
+ADAPTATION_STORE = "sampler_adaptation.json"
+
+
+def adaptation_store_path():
+    space = workspace.Workspace("reco_adaptation")
+    if space.has_dir():
+        return space(ADAPTATION_STORE)
+    # Without workspace state is kept next to workspace config, not in current directory
+    return os.path.join(workspace.USER_DATA_DIR, ADAPTATION_STORE)
+
+
+def model_structure_key(model):
+    """
+    Key of model free variables layout (names, shapes and transforms). Adapted sampler state is valid for
+    any model with same key regardless of observed data.
+    """
+    point = model.initial_point()
+    items = []
+    for rv in model.free_RVs:
+        value = model.rvs_to_values[rv]
+        transform = model.rvs_to_transforms.get(rv)
+        items.append(f"{value.name}:{np.shape(point[value.name])}:{type(transform).__name__}")
+    return hashlib.sha256(";".join(items).encode("utf-8")).hexdigest()[:16]
+
+
+def export_adaptation(model, trace):
+    """
+    Extract adapted NUTS state from finished run: step size and posterior mean/variance
+    of unconstrained variables (which is what diagonal mass matrix adaptation estimates).
+    Trace must contain transformed variables.
+    """
+    mean = dict()
+    var = dict()
+    for value in model.value_vars:
+        samples = trace.posterior[value.name].values
+        samples = samples.reshape((-1,)+samples.shape[2:])
+        mean[value.name] = samples.mean(axis=0).tolist()
+        var[value.name] = samples.var(axis=0).tolist()
+    step_size = float(np.median(trace.sample_stats["step_size"].values[:, -1]))
+    return dict(step_size=step_size, mean=mean, var=var)
+
+
+def load_adaptation(key):
+    path = adaptation_store_path()
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as fp:
+        store = json.load(fp)
+    return store.get(key)
+
+
+def save_adaptation(key, state):
+    path = adaptation_store_path()
+    store = dict()
+    if os.path.isfile(path):
+        with open(path, "r") as fp:
+            store = json.load(fp)
+    store[key] = state
+    with open(path, "w") as fp:
+        json.dump(store, fp)
+    print(f"Saved sampler adaptation {key} to {path}")
+
+
+def make_adapted_nuts(model, state, target_accept, initial_weight=50):
+    """
+    Create NUTS step starting from saved adaptation
+    """
+    from pymc.step_methods.hmc.quadpotential import QuadPotentialDiagAdapt
+    value_vars = model.value_vars
+    mean = np.concatenate([np.ravel(state["mean"][v.name]) for v in value_vars])
+    var = np.concatenate([np.ravel(state["var"][v.name]) for v in value_vars])
+    var = np.where(var > 0, var, 1.0)
+    n = len(mean)
+    potential = QuadPotentialDiagAdapt(n, mean, var, initial_weight)
+    # NUTS step size is step_scale/n**0.25
+    return pm.NUTS(vars=value_vars, potential=potential, step_scale=state["step_size"]*n**0.25,
+                   target_accept=target_accept)
+
+
 class PyMCSampleArgsResource(CombineResource):
     Fields = ResourceRequest({
         "draws": dict(display_name="Draws", default_value=2000),
@@ -19,17 +224,70 @@ class PyMCSampleArgsResource(CombineResource):
         "target_accept": dict(display_name="Target accept rate", default_value=0.95),
         "random_seed": dict(display_name="Random seed", default_value=5),
         "nuts_sampler": dict(display_name="NUTS sampler", default_value="pymc", type_=NUTSSamplerResource),
+        "convergence": dict(display_name="Stop when converged", type_=ConvergenceTargetsOption),
+        "adaptation": dict(display_name="Reuse sampler adaptation", default_value="off",
+                           type_=AdaptationReuseResource),
+        "reused_tune": dict(display_name="Tune when adaptation is reused", default_value=300),
     })
 
-    def sample(self):
-        return pm.sample(
-            draws=self.data.get("draws"),
-            tune=self.data.get("tune"),
-            chains=self.data.get("chains"),
-            target_accept=self.data.get("target_accept"),
+    def sample(self, **kwargs):
+        """
+        Sample current model
+        :param kwargs: additional pm.sample arguments (init, initvals, ...)
+        """
+        draws = self.data.get("draws")
+        tune = self.data.get("tune")
+        chains = self.data.get("chains")
+        # Projects saved before adaptation reuse have no such field
+        adaptation = self.data.try_get("adaptation") or "off"
+        if adaptation != "off" and self.data.get("nuts_sampler") != "pymc":
+            print("Adaptation reuse is available only for PyMC NUTS sampler")
+            adaptation = "off"
+        model = pm.modelcontext(None)
+        if adaptation != "off":
+            key = model_structure_key(model)
+            kwargs["idata_kwargs"] = dict(include_transformed=True)
+            state = load_adaptation(key) if adaptation == "reuse" else None
+            if state is not None:
+                print(f"Reusing sampler adaptation {key}")
+                kwargs["step"] = make_adapted_nuts(model, state, self.data.get("target_accept"))
+                kwargs.pop("init", None)
+                tune = self.data.get("reused_tune")
+
+        # Callbacks slice tuning draws off the trace, so they are built with final tune count.
+        # Projects saved before adaptive mode have no such field
+        targets = self.data.try_get("convergence")
+        if self.data.get("nuts_sampler") == "pymc":
+            # Other samplers do not support per draw callbacks
+            callback = SamplingProgress(draws, tune, chains)
+            if targets is not None:
+                draws = targets.get("max_draws")
+                callback.draws = draws
+                var_names = [rv.name for rv in model.free_RVs]
+                callback = ConvergenceStop(targets, tune, chains, var_names, inner=callback)
+                kwargs["cores"] = chains
+            kwargs["callback"] = callback
+        elif targets is not None:
+            print("Convergence based stopping is available only for PyMC NUTS sampler. Using fixed draws count")
+
+        if "step" not in kwargs.keys():
+            # Explicit step already has its own target acceptance rate
+            kwargs["target_accept"] = self.data.get("target_accept")
+        trace = pm.sample(
+            draws=draws,
+            tune=tune,
+            chains=chains,
             random_seed=self.data.get("random_seed"),
-            nuts_sampler=self.data.get("nuts_sampler")
+            nuts_sampler=self.data.get("nuts_sampler"),
+            **kwargs
         )
+        if adaptation != "off":
+            save_adaptation(key, export_adaptation(model, trace))
+            # Transformed variables were needed only for export
+            transformed = [model.rvs_to_values[rv].name for rv in model.free_RVs
+                           if model.rvs_to_transforms.get(rv) is not None]
+            trace.posterior = trace.posterior.drop_vars([name for name in transformed if name in trace.posterior])
+        return trace
 
 class AdviMethodChoiceResource(ChoiceResource):
     Choices = {
@@ -47,7 +305,7 @@ class AdviFitArgsResource(CombineResource):
     })
     def get_kwargs(self):
         r = dict()
-        for k in [self.Fields.requests.keys()]:
+        for k in self.Fields.requests.keys():
             r[k] = self.data.get(k)
         return r
 
@@ -59,7 +317,7 @@ class AdviDrawsArgsResource(CombineResource):
 
     def get_kwargs(self):
         r = dict()
-        for k in [self.Fields.requests.keys()]:
+        for k in self.Fields.requests.keys():
             r[k] = self.data.get(k)
         return r
 
@@ -70,18 +328,108 @@ class AdviSampleArgsResource(CombineResource):
         "sample_args": dict(display_name="Sample arguments", type_=AdviDrawsArgsResource),
     })
 
-    def sample(self):
+    def sample(self, **kwargs):
         fit_kwargs = self.data.get_resource("fit_args").get_kwargs()
         sample_kwargs = self.data.get_resource("sample_args").get_kwargs()
-        approx = pm.fit(**fit_kwargs)
+        approx = pm.fit(callbacks=[FitProgress(fit_kwargs.get("n", 10000))], **fit_kwargs)
         return approx.sample(**sample_kwargs)
 
 
+class MinibatchAdviArgsResource(AdviSampleArgsResource):
+    Fields = ResourceRequest({
+        "batch_size": dict(display_name="Batch size", default_value=10000),
+        "fit_args": dict(display_name="Fit arguments", type_=AdviFitArgsResource),
+        "sample_args": dict(display_name="Sample arguments", type_=AdviDrawsArgsResource),
+    })
+
+    def minibatch(self, *arrays):
+        """
+        Random minibatches of observation arrays. All arrays are sliced with same indices on each iteration.
+        Likelihood built on them must get total_size of full data to be scaled properly.
+        """
+        return pm.Minibatch(*arrays, batch_size=self.data.get("batch_size"))
+
+
+class MinibatchAdviOption(OptionResource):
+    OptionType = MinibatchAdviArgsResource
+
+
+class LaplaceSampleArgsResource(CombineResource):
+    Fields = ResourceRequest({
+        "draws": dict(display_name="Draws", default_value=2000),
+        "random_seed": dict(display_name="Random seed", default_value=5),
+        "maxeval": dict(display_name="Max optimizer evaluations", default_value=5000),
+    })
+
+    def sample(self, **kwargs):
+        """
+        Find posterior mode and approximate posterior with normal distribution in unconstrained space
+        (covariance is inverse Hessian of -logp at mode). Returns InferenceData with one chain of draws.
+        :param kwargs: pm.sample arguments. Ignored: optimizer starts from model initial point (initvals included)
+        """
+        model = pm.modelcontext(None)
+        seed = self.data.get("random_seed")
+        mode = pm.find_MAP(maxeval=self.data.get("maxeval"), progressbar=False, seed=seed)
+
+        value_vars = model.value_vars
+        mean = np.concatenate([np.ravel(mode[v.name]) for v in value_vars])
+        hessian = np.atleast_2d(pm.find_hessian(mode, vars=value_vars))
+        eigvals, eigvecs = np.linalg.eigh((hessian+hessian.T)/2)
+        floor = 1e-8*max(np.max(np.abs(eigvals)), 1.0)
+        if np.any(eigvals < floor):
+            print("Hessian at mode is not positive definite. Flat directions are clipped")
+        eigvals = np.maximum(eigvals, floor)
+
+        rng = np.random.default_rng(seed)
+        z = rng.standard_normal((self.data.get("draws"), len(mean)))
+        flat_samples = mean + (z/np.sqrt(eigvals)) @ eigvecs.T
+
+        # Evaluate constrained variables and deterministics for each draw
+        transformed = [model.rvs_to_values[rv] for rv in model.free_RVs
+                       if model.rvs_to_transforms.get(rv) is not None]
+        outputs = [v for v in model.unobserved_value_vars if v not in transformed]
+        fn = model.compile_fn(outputs, inputs=value_vars, on_unused_input="ignore", point_fn=False)
+        shapes = [np.shape(mode[v.name]) for v in value_vars]
+        splits = np.cumsum([int(np.prod(shape)) for shape in shapes])[:-1]
+        posterior = {v.name: [] for v in outputs}
+        for sample in flat_samples:
+            parts = np.split(sample, splits)
+            values = fn(*[part.reshape(shape).astype(v.dtype) for part, shape, v in zip(parts, shapes, value_vars)])
+            for v, value in zip(outputs, values):
+                posterior[v.name].append(value)
+        posterior = {k: np.array(v)[None, ...] for k, v in posterior.items()}
+        return az.from_dict(posterior=posterior)
+
+
+class SMCSampleArgsResource(CombineResource):
+    Fields = ResourceRequest({
+        "draws": dict(display_name="Particles", default_value=2000),
+        "chains": dict(display_name="Chains", default_value=4),
+        "cores": dict(display_name="Cores", default_value=4),
+        "random_seed": dict(display_name="Random seed", default_value=5),
+    })
+
+    def sample(self, **kwargs):
+        """
+        Sample current model with sequential Monte Carlo. Particles are tempered from prior to posterior,
+        so separated modes are populated in one run.
+        :param kwargs: pm.sample arguments. Ignored: SMC starts from prior draws
+        """
+        return pm.sample_smc(
+            draws=self.data.get("draws"),
+            chains=self.data.get("chains"),
+            cores=self.data.get("cores"),
+            random_seed=self.data.get("random_seed"),
+        )
+
+
 class PymcSampleAlternateResource(AlternatingResource):
     Variants = [
         ResourceVariant(PyMCSampleArgsResource,"MCMC"),
         ResourceVariant(AdviSampleArgsResource,"ADVI"),
+        ResourceVariant(LaplaceSampleArgsResource,"MAP/Laplace"),
+        ResourceVariant(SMCSampleArgsResource,"SMC"),
     ]
 
-    def sample(self):
-        return self.value.sample()
+    def sample(self, **kwargs):
+        return self.value.sample(**kwargs)
@@ -6,7 +6,6 @@ from RecoResources import BlankResource
 from RecoResources.prior_resource import NormalMaker
 from stars import StarList, Star
 from stars.star_parser import parse_one_star
-import numba as nb
 
 
 
@@ -29,6 +28,9 @@ class StarEntry(StringResource):
 
 
 class BrightnessModifier(object):
+    # Amplitude is a model variable, not fixed ratio of star brightness
+    FreeAmplitude = False
+
     def get_rng_modifier(self, star):
         raise NotImplementedError
 
@@ -51,6 +53,7 @@ class VMagnitudeBasedModifier(BlankResource, BrightnessModifier):
 
 
 class ManualRandomModifier(CombineResource, BrightnessModifier):
+    FreeAmplitude = True
     Fields = ResourceRequest({
         "amplitude": dict(display_name="Signal amplitude", default_value = NormalMaker.template(1.0,0.001))
     })
@@ -115,8 +118,11 @@ class StarPinResource(CombineResource):
         yi = self.data.get("fixed_y0")
         return ti, xi, yi
 
+    def get_modifier(self) -> BrightnessModifier:
+        return self.data.get_resource("amplitude").value
+
     def get_rng_modifier(self):
-        return self.data.get_resource("amplitude").get_rng_modifier(self.get_star())
+        return self.get_modifier().get_rng_modifier(self.get_star())
 
 
 def deduplicate(arr:list, cmp=None):
@@ -145,22 +151,25 @@ class PinnedStars(ArrayResource):
         a = deduplicate(a)
         return StarList(a)
 
-    def get_stars_with_amplitudes(self):
-        # a = [item.get_star() for item in self.data]
+    def get_stars_with_modifiers(self):
+        '''
+        Unique stars with brightness modifiers of their first entries
+        '''
         a = dict()
         for item in self.data:
             star = item.get_star()
             key = star.get_star_identifier()
             if key not in a.keys():
-                a[key] = (star, item.get_rng_modifier())
-        av = list(a.values())
-        # a = [(item.get_star(), item.get_rng_modifier()) for item in self.data]
-        # a = deduplicate(a, cmp=lambda x,y: x[0] == y[0])
-        av = list(zip(*av))
-        av[0] = list(av[0])
-        av[1] = list(av[1])
-        print("Stars and amplitudes",av[0],av[1])
-        return StarList(av[0]), av[1]
+                a[key] = (star, item.get_modifier())
+        stars = [star for star, _ in a.values()]
+        modifiers = [modifier for _, modifier in a.values()]
+        return StarList(stars), modifiers
+
+    def get_stars_with_amplitudes(self):
+        stars, modifiers = self.get_stars_with_modifiers()
+        amplitudes = [modifier.get_rng_modifier(star) for star, modifier in zip(stars, modifiers)]
+        print("Stars and amplitudes",stars,amplitudes)
+        return stars, amplitudes
 
     def add_star(self,star_id):
         parsed_star = parse_one_star(star_id)
@@ -1,10 +1,12 @@
 from RecoResources import CombineResource, ResourceRequest, StrictFunction, BlankResource, ResourceVariant, \
-    AlternatingResource, DistributionResource, ChoiceResource
-import pymc as pm
+    AlternatingResource, DistributionResource, ChoiceResource, OptionResource
+from RecoResources.lazy_module import lazy_import
 from pymc_sampling import PyMCSampleArgsResource
 import numpy as np
 from transform import TransformBuilder, ecef_align, projection_matrix
 
+pm = lazy_import("pymc")
+
 
 
 
@@ -42,3 +44,26 @@ class PositionPriorAlternate(AlternatingResource):
         ResourceVariant(AutoPositionPrior, "Automatic"),
         ResourceVariant(ManualPositionPrior, "Manual")
     ]
+
+
+class RegionOfInterestResource(CombineResource):
+    Fields = ResourceRequest({
+        "n_sigma": dict(display_name="Max distance from track [PSF sigmas]", default_value=5.0),
+        "sampling_step": dict(display_name="Track sampling step [frames]", default_value=0.5),
+    })
+
+
+class RegionOfInterestOption(OptionResource):
+    OptionType = RegionOfInterestResource
+
+
+class SignalWindowResource(CombineResource):
+    Fields = ResourceRequest({
+        "threshold": dict(display_name="Threshold [noise sigmas]", default_value=5.0),
+        "padding": dict(display_name="Padding [frames]", default_value=5),
+        "smoothing": dict(display_name="Moving average window [frames]", default_value=3),
+    })
+
+
+class SignalWindowOption(OptionResource):
+    OptionType = SignalWindowResource
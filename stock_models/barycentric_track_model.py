@@ -1,9 +1,11 @@
 from matplotlib import pyplot as plt
 import numpy as np
-from scipy.optimize import curve_fit, minimize
 
 from reco_prelude import ResourceStorage, ReconsructionModel, ResourceRequest, LabelledAction
 from reco_prelude import HDF5Resource, DetectorResource, Scene
+from envelope_plot import EnvelopePlot
+from barycentric import track_approx, fit_pixels, pixel_series, fit_active_pixels, barycenter_trajectory
+from barycentric import fit_linear_motion
 
 
 
@@ -19,7 +21,7 @@ class DetectorScene(Scene):
             return
         #trace = resources.try_get("trace")
 
-        frame = np.max(data, axis=0)
+        frame = resources.get_resource("reco_data").get_statistics().max
         lx, mx, ly, my = detector.draw(axes, frame)
         axes.set_xlim(lx, mx)
         axes.set_ylim(ly, my)
@@ -62,19 +64,13 @@ class PlotsScene(Scene):
         data = resources.try_get("reco_data")
         if data is None or detector is None:
             return
-        xs = np.arange(data.shape[0])
         axes.autoscale()
         axes.set_aspect("auto")
-        detector = resources.try_get("detector")
-        lc = np.zeros(data.shape[0])
-        if detector is None:
-            return
+        pyramid = resources.get_resource("reco_data").get_envelope()
+        plot = EnvelopePlot(axes)
         for i in detector.iterate():
             if detector.pixel_is_active(i):
-                s = (slice(None),) + i
-                axes.plot(xs, data[s])
-                lc += data[s]
-        #axes.plot(xs, lc, color="black")
+                plot.plot(pyramid, i)
 
     @classmethod
     def on_scene_mouse_event(cls, resources: ResourceStorage, event):
@@ -116,19 +112,6 @@ class PlotY(PlotAxis):
     K_LABEL = "ky"
     B_LABEL = "by"
 
-def track_approx(x,b0,b1,b2,a,x0,sd):
-    return b0+b1*x+b2*x**2+a*np.exp(-0.5*((x-x0)/sd)**2)
-
-
-def trunc_track_approx(x,a,x0,sd):
-    return a*np.exp(-0.5*((x-x0)/sd)**2)
-
-def fit_pixel(xdata,ydata):
-    p0 = np.array([0.0, 0.0, 0.0, np.max(ydata), np.argmax(ydata), 1.0])
-    popt, pcov = curve_fit(track_approx, xdata, ydata, p0, method="lm")
-    perr = np.sqrt(np.diag(pcov))
-    return popt,perr
-
 class BarycentricTrackModel(ReconsructionModel):
     '''
     A fairly simple track reconstruction method.
@@ -154,84 +137,25 @@ class BarycentricTrackModel(ReconsructionModel):
         reco_data = resources.get("reco_data")
         detector = resources.get("detector")
         print(reco_data)
-        pixel_activations = dict()
-        xdata = np.arange(reco_data.shape[0])
         use_real = resources.get("use_real_signal")
-        for i in detector.iterate():
-            if detector.pixel_is_active(i):
-                s = (slice(None),) + i
-                ydata = reco_data[s]
-                try:
-                    popt,perr = fit_pixel(xdata, ydata)
-                    b0, b1, b2, a, x0, sd = popt
-                    pixel_activations[i] = popt
-                    print(f"Pixel {i} is active in interval {pixel_activations[i]}")
-                except RuntimeError:
-                    print("No convergence...")
-
-        data = []
-        for t in xdata:
-            x = 0.0
-            y = 0.0
-            xy_sum = 0.0
-            has_signal = False
-            for pixel in detector.pixels:
-                if detector.pixel_is_active(pixel.index):
-                    if pixel.index in pixel_activations.keys():
-                        popt = pixel_activations[pixel.index]
-                        b0, b1, b2, a, x0, sd = popt
-                        t_start = x0-3*sd
-                        t_end = x0+3*sd
-                        if t_start<=t<=t_end:
-                            data_index = (t,) + pixel.index
-                            #print("DATA INDEX", data_index)
-                            #s = float(reco_data[data_index])
-                            if use_real:
-                                s = float(reco_data[data_index]) - (b0+b1*t+b2*t**2)
-                            else:
-                                s = a*np.exp(-0.5*((t-x0)/sd)**2)
-                            x += s*np.mean(pixel.vertices[:, 0])
-                            y += s*np.mean(pixel.vertices[:, 1])
-                            xy_sum += s
-                            has_signal = True
-            if xy_sum != 0:
-                x /= xy_sum
-                y /= xy_sum
-            if not has_signal:
-                continue
-            #print(t,x,y)
-            data.append([t,x,y])
-        data = np.array(data)
-        resources.set("trajectory",data)
-        trajectory = data
+        pixel_activations = fit_active_pixels(reco_data, detector)
+        trajectory = barycenter_trajectory(reco_data, detector, pixel_activations, use_real)
+        resources.set("trajectory",trajectory)
         use_robust = resources.get("use_robust_linreg")
 
-        def linreg(x,k,b):
-            return k*x+b
-
         def opt_del(label):
             if resources.has_resource(label):
                 resources.delete_resource(label)
 
-        if use_robust:
-            used_loss = "soft_l1"
-        else:
-            used_loss = "linear"
-
-        def mod_fit(axis,k_label,b_label):
-            try:
-                popt,pcov = curve_fit(linreg,trajectory[:,0],trajectory[:,axis],p0=np.array([1.0,0.0]),
-                                      method="dogbox", loss=used_loss)
-                kx, bx = popt
-                #axes.plot(trajectory[:,0],linreg(trajectory[:,0],*popt), color="black")
-                resources.set(k_label,kx)
-                resources.set(b_label,bx)
-            except RuntimeError:
+        fits = fit_linear_motion(trajectory, use_robust)
+        for fit, k_label, b_label in zip(fits, ["kx", "ky"], ["bx", "by"]):
+            if fit is None:
                 opt_del(k_label)
                 opt_del(b_label)
+            else:
+                resources.set(k_label, fit[0])
+                resources.set(b_label, fit[1])
 
-        mod_fit(1,"kx","bx")
-        mod_fit(2,"ky","by")
         kx = resources.try_get("kx")
         ky = resources.try_get("ky")
         if kx is not None and ky is not None:
@@ -252,36 +176,27 @@ class BarycentricTrackModel(ReconsructionModel):
         reco_data = resources.get("reco_data")
         detector = resources.get("detector")
         sigma_thresh = resources.get("signal_threshold")
-        for i in detector.iterate():
-            s = (slice(None),) + i
-            ydata = reco_data[s]
-            xdata = np.arange(len(ydata))
-            ok = True
-            try:
-                popt,perr = fit_pixel(xdata, ydata)
-                b0, b1, b2, a, x0, sd = popt
-                sb0, sb1, sb2, sa, sx0, ssd = perr
-                if a<=3*sa:
-                    #Condition 2 fail:  the fitted value of the Gaussian height is not big enough
-                    ok = False
-
-                sigma = (np.mean((ydata-track_approx(xdata,b0, b1, b2, a, x0, sd))**2))**0.5
-                y_flat = track_approx(xdata,b0, b1, b2, 0.0, x0, sd)
-                if not ((ydata-y_flat)>sigma_thresh*sigma).any():
-                    # Condition 3 fail: lightcurve does not have any points larger than 3 sigma
-                    ok = False
-
-                if x0<0 or x0>xdata[-1]:
-                    # Condition 4 fail: x0 if out of bounds
-                    ok = False
-
-                if sd<resources.get("duration_threshold"):
-                    # Condition 5 fail...ish : peak is not long enough
-                    ok = False
-
-                print(popt, sigma)
-            except RuntimeError:
-                # Condition 1 fail: not a successful convergence
-                print("No convergence")
-                ok = False
-            detector.set_pixel_active(i,ok)
\ No newline at end of file
+        indices = list(detector.iterate())
+        ydata = pixel_series(reco_data, indices)
+        xdata = np.arange(ydata.shape[1])
+        popt, perr, converged = fit_pixels(xdata, ydata)
+        b0, b1, b2, a, x0, sd = popt.T[:, :, None]
+        sa = perr[:, 3]
+
+        # Condition 1: successful convergence
+        ok = converged.copy()
+        # Condition 2: the fitted value of the Gaussian height is big enough
+        ok &= a[:, 0] > 3*sa
+
+        sigma = (np.mean((ydata-track_approx(xdata, b0, b1, b2, a, x0, sd))**2, axis=1))**0.5
+        y_flat = track_approx(xdata, b0, b1, b2, 0.0, x0, sd)
+        # Condition 3: lightcurve has points larger than 3 sigma
+        ok &= ((ydata-y_flat) > sigma_thresh*sigma[:, None]).any(axis=1)
+        # Condition 4: x0 is in bounds
+        ok &= (x0[:, 0] >= 0) & (x0[:, 0] <= xdata[-1])
+        # Condition 5...ish: peak is long enough
+        ok &= sd[:, 0] >= resources.get("duration_threshold")
+
+        print(f"Converged {np.count_nonzero(converged)}, selected {np.count_nonzero(ok)} of {len(indices)} pixels")
+        for i, value in zip(indices, ok):
+            detector.set_pixel_active(i, bool(value))
@@ -8,18 +8,40 @@ from matplotlib import pyplot as plt
 from RecoResources import ResourceStorage, StrictFunction, Resource, DisplayList
 from reco_prelude import ResourceRequest, ReconsructionModel, HDF5Resource, DetectorResource, AlternatingResource
 from reco_prelude import ResourceVariant, BlankResource, CombineResource, DistributionResource, template_uniform
-from reco_prelude import Scene
-from RecoResources.prior_resource import template_exponent
-from track_resources import PyMCSampleArgsResource, PositionPriorAlternate
+from reco_prelude import Scene, LabelledAction
+from RecoResources.prior_resource import template_exponent, template_circular
+from track_resources import PyMCSampleArgsResource, PositionPriorAlternate, RegionOfInterestOption
+from track_resources import SignalWindowOption
+from pymc_sampling import set_initvals, PrecisionResource, cast_trace
+from linear_marginal import marginal_gaussian_amplitudes
+from pixel_psf import pixel_gaussian, pixel_gaussian_quadrature
+from barycentric import estimate_linear_track, pixels_near_trajectory, detect_signal_window, pixel_series
 from lc_resources import MainLC
+from envelope_plot import EnvelopePlot
 
 
 def estimate(trace,key):
     return np.median(trace.posterior[key])
 
-def d_erf(a,b,mu,sigma):
-    scale = sigma*2**0.5
-    return (pm.math.erf((b-mu)/scale)-pm.math.erf((a-mu)/scale))/2.0
+
+def estimate_angle(trace,key):
+    # Circular mean: samples may be spread across 0/360 boundary
+    angle = np.asarray(trace.posterior[key])*np.pi/180
+    return np.arctan2(np.mean(np.sin(angle)), np.mean(np.cos(angle)))
+
+def stacked_light_curves(data, indices, w, active_win):
+    '''
+    Moving averages of pixel light curves, zeroed farther than active_win from their peaks
+    and stacked in order of peak position
+    :return: array (time, pixels) of stack boundaries
+    '''
+    series = np.array([np.convolve(ydata, np.ones(w), 'same') / w for ydata in pixel_series(data, indices)])
+    maxpos = np.argmax(series, axis=1)
+    offset = np.arange(data.shape[0])-maxpos[:, None]
+    series[(offset < -active_win) | (offset >= active_win)] = 0.0
+    order = np.argsort(maxpos)
+    return np.cumsum(series[order], axis=0).T
+
 
 class ImageScene(Scene):
     SceneName = "Image"
@@ -32,7 +54,7 @@ class ImageScene(Scene):
             return
         trace = resources.try_get("trace")
 
-        frame = np.max(data, axis=0)
+        frame = resources.get_resource("reco_data").get_statistics().max
         lx, mx, ly, my = detector.draw(axes, frame)
         print(detector)
         axes.set_xlim(lx, mx)
@@ -42,7 +64,7 @@ class ImageScene(Scene):
             x0 = estimate(trace, "X0")
             y0 = estimate(trace, "Y0")
             u0 = estimate(trace, "u0")
-            phi0 = estimate(trace, "phi0") * np.pi / 180
+            phi0 = estimate_angle(trace, "phi0")
             ts = np.array([resources.get("k_start"), resources.get("k_end")])
             k0 = resources.get("k0")
             x = x0 + u0 * np.cos(phi0) * (ts - k0)
@@ -90,19 +112,17 @@ class PlotsScene(Scene):
         if data is None or detector is None:
             return
         trace = resources.try_get("trace")
-        xs = np.arange(data.shape[0])
         axes.autoscale()
         axes.set_aspect("auto")
-        detector = resources.try_get("detector")
-        lc = np.zeros(data.shape[0])
-        if detector is None:
-            return
-        for i in detector.iterate():
-            if detector.pixel_is_active(i):
-                s = (slice(None),) + i
-                axes.plot(xs, data[s])
-                lc += data[s]
-        axes.plot(xs, lc, color="black")
+        reco_data = resources.get_resource("reco_data")
+        pyramid = reco_data.get_envelope()
+        plot = EnvelopePlot(axes)
+        active = [i for i in detector.iterate() if detector.pixel_is_active(i)]
+        for i in active:
+            plot.plot(pyramid, i)
+        lc_pyramid = reco_data.get_derived_envelope(("sum", tuple(active)),
+                                                    lambda x: np.sum(pixel_series(x, active), axis=0))
+        plot.plot(lc_pyramid, color="black")
         if trace is not None and resources.has_resource("lc_conf"):
             lc_params = resources.get("lc_conf")
             lc_conf: MainLC = Resource.unpack(json.loads(lc_params))
@@ -125,32 +145,18 @@ class PlotsAltScene(Scene):
         if data is None or detector is None:
             return
         trace = resources.try_get("trace")
-        xs = np.arange(data.shape[0])
         axes.autoscale()
         axes.set_aspect("auto")
-        detector = resources.try_get("detector")
-        lc = np.zeros(data.shape[0])
-        if detector is None:
-            return
-        accum = []
-        metrics = []
         w = resources.get("ma_filter")
         active_win = resources.get("active_window")
-        for i in detector.iterate():
-            if detector.pixel_is_active(i):
-                s = (slice(None),) + i
-                #axes.plot(xs, data[s])
-                ydata = np.convolve(data[s], np.ones(w), 'same') / w
-                accum.append(ydata)
-                maxpos = np.argmax(ydata)
-                metrics.append(maxpos)
-                ydata[:max(0,maxpos-active_win)] = 0.0
-                ydata[min(len(ydata),maxpos+active_win):] = 0.0
-                lc += ydata
-        accum = np.array(accum)
-        order = np.argsort(metrics)
-        axes.stackplot(xs,accum[order])
-        #axes.plot(xs, lc, color="black")
+        active = [i for i in detector.iterate() if detector.pixel_is_active(i)]
+        if active:
+            key = ("stack", tuple(active), w, active_win)
+            pyramid = resources.get_resource("reco_data").get_derived_envelope(
+                key, lambda x: stacked_light_curves(x, active, w, active_win))
+            plot = EnvelopePlot(axes)
+            for k in range(len(active)):
+                plot.fill(pyramid, (k,), (k-1,) if k > 0 else None)
 
 
         if trace is not None and resources.has_resource("lc_conf"):
@@ -172,6 +178,8 @@ class LinearTrackModel(ReconsructionModel):
         "k_start": dict(display_name="Start frame",default_value=0),
         "k_end": dict(display_name="End frame", default_value=-1),
         "k0": dict(display_name="Zero frame", default_value=0.0),
+        "frame_binning": dict(display_name="Sum frames in bins of", default_value=1),
+        "auto_window": dict(display_name="Narrow frame window to detected signal", type_=SignalWindowOption),
         "ma_filter": dict(display_name="MA filter", default_value=1, category="Display"),
         "active_window": dict(display_name="Active signal window", default_value=10, category="Display"),
         "pymc_sampling": dict(display_name="PyMC arguments", type_=PyMCSampleArgsResource),
@@ -180,12 +188,17 @@ class LinearTrackModel(ReconsructionModel):
         "reco_time": dict(display_name="Reconstruction time", type_=HDF5Resource),
         "ref_position": dict(display_name="(X0,Y0) [mm]", type_=PositionPriorAlternate,category="Priors"),
         "u0": dict(display_name="U0 [mm/fr]", default_value=template_uniform(0.01,2.0),category="Priors"),
-        "phi0": dict(display_name="Phi0 [deg]", default_value=template_uniform(0.0,360.0),category="Priors"),
+        "phi0": dict(display_name="Phi0 [deg]", default_value=template_circular(0.0,0.0),category="Priors"),
         "sigma_psf": dict(display_name="Sigma PSF [mm]", default_value=template_exponent(0.5,False),
                           category="Priors"),
         "sigma": dict(display_name="Sigma 0", default_value=template_exponent(1.0,False),category="Priors"),
         "lc":dict(display_name="Light curve", type_=MainLC,category="Priors"),
         "sigma_individual":dict(display_name="Individual sigma", default_value=False),
+        "warm_start":dict(display_name="Start sampling from barycentric estimate", default_value=False),
+        "exact_pixel_shape":dict(display_name="Integrate PSF over exact pixel shape", default_value=False),
+        "roi":dict(display_name="Fit only pixels near barycentric track estimate", type_=RegionOfInterestOption),
+        "marginalize_e0":dict(display_name="Marginalize E0 analytically (flat E0 prior)", default_value=False),
+        "precision":dict(display_name="Floating point precision", type_=PrecisionResource),
 
         "latitude": dict(display_name="Latitude [°]", default_value=0.0, category="Display"),
         "longitude": dict(display_name="Longitude [°]", default_value=0.0, category="Display"),
@@ -198,6 +211,68 @@ class LinearTrackModel(ReconsructionModel):
     DisplayList = DisplayList.whitelist(["trace"])
     Scenes = [ImageScene,PlotsScene, PlotsAltScene]
 
+    @staticmethod
+    def barycentric_initvals(estimate, k0):
+        """
+        Track parameters from barycentric estimate
+        :param estimate: estimate_linear_track result for reconstruction interval
+        :param k0: zero frame relative to interval start
+        """
+        if "u0" not in estimate.keys():
+            print("Barycentric estimate failed. Using default initialization")
+            return dict()
+        initvals = dict(
+            X0=estimate["kx"]*k0+estimate["bx"],
+            Y0=estimate["ky"]*k0+estimate["by"],
+            u0=estimate["u0"],
+            phi0=estimate["phi"] % 360.0,
+        )
+        # Free variable of circular direction prior
+        phi = estimate["phi"]*np.pi/180.0
+        initvals["phi0_vec_"] = np.array([np.cos(phi), np.sin(phi)])
+        print("Barycentric estimate", initvals)
+        return initvals
+
+    @staticmethod
+    def signal_window(data, detector, k_start, k_end, threshold=5.0, padding=5, smoothing=3):
+        """
+        Frames with signal in summed light curve of active pixels within k_start:k_end
+        :return: narrowed (k_start, k_end) or None if no signal is detected
+        """
+        start, end, _ = slice(k_start, k_end).indices(data.shape[0])
+        light_curve = data[start:end][:, detector.alive_pixels].sum(axis=1)
+        window = detect_signal_window(light_curve, threshold, padding, smoothing)
+        if window is None:
+            print("No signal detected. Frame window is kept")
+            return None
+        print(f"Frame window {start}:{end} narrowed to {start+window[0]}:{start+window[1]}. "
+              f"Saved {(end-start)-(window[1]-window[0])} frames")
+        return int(start+window[0]), int(start+window[1])
+
+    @staticmethod
+    def apply_signal_window(resources, threshold=5.0, padding=5, smoothing=3):
+        """
+        Narrow stored k_start/k_end to detected signal window
+        """
+        window = LinearTrackModel.signal_window(resources.get("reco_data"), resources.get("detector"),
+                                                resources.get("k_start"), resources.get("k_end"),
+                                                threshold, padding, smoothing)
+        if window is not None:
+            resources.set("k_start", window[0])
+            resources.set("k_end", window[1])
+
+    @LabelledAction("Detect signal window")
+    @staticmethod
+    def detect_window(resources):
+        if not resources.has_resource("reco_data") or not resources.has_resource("detector"):
+            return
+        params = resources.try_get("auto_window")
+        if params is None:
+            LinearTrackModel.apply_signal_window(resources)
+        else:
+            LinearTrackModel.apply_signal_window(resources, params.get("threshold"), params.get("padding"),
+                                                 params.get("smoothing"))
+
     @classmethod
     def calculate(cls, resources:ResourceStorage):
         data = resources.try_get("reco_data")
@@ -208,7 +283,43 @@ class LinearTrackModel(ReconsructionModel):
             return
         k_start = resources.get("k_start")
         k_end = resources.get("k_end")
+        # Negative and None bounds are resolved here: frame times below are built from explicit indices
+        k_start, k_end, _ = slice(k_start, k_end).indices(data.shape[0])
+        # Projects saved before automatic window have no such field
+        auto_window = resources.try_get("auto_window")
+        if auto_window is not None:
+            # Stored window stays as user set it, only this run is narrowed
+            window = cls.signal_window(data, detector, k_start, k_end, auto_window.get("threshold"),
+                                       auto_window.get("padding"), auto_window.get("smoothing"))
+            if window is not None:
+                k_start, k_end = window
         k0 = resources.get("k0")
+        # Projects saved before binning have no such field
+        binning = max(1, resources.try_get("frame_binning") or 1)
+        if binning > 1:
+            # Incomplete last bin is dropped
+            n_bins = (k_end-k_start)//binning
+            k_end = k_start+n_bins*binning
+            print(f"Frames are binned by {binning}: {n_bins} bins")
+        active = [pixel for pixel in detector.pixels if detector.pixel_is_active(pixel.index)]
+        # Projects saved before region of interest stage have no such field
+        roi = resources.try_get("roi")
+        track_estimate = None
+        if resources.try_get("warm_start") or roi is not None:
+            track_estimate = estimate_linear_track(data[k_start:k_end], detector)
+        near = np.full(len(active), True)
+        if roi is not None:
+            psf_estimate = resources.get_resource("sigma_psf").get_estimation()
+            if "u0" not in track_estimate.keys() or psf_estimate is None:
+                print("Region of interest requires track and PSF estimates. Using all active pixels")
+            else:
+                t = np.arange(0, data[k_start:k_end].shape[0], roi.get("sampling_step"))
+                near = pixels_near_trajectory(active, track_estimate["kx"]*t+track_estimate["bx"],
+                                              track_estimate["ky"]*t+track_estimate["by"],
+                                              roi.get("n_sigma")*psf_estimate)
+                print(f"Region of interest: {np.sum(near)} of {len(active)} active pixels")
+        fitted = [pixel for pixel, is_near in zip(active, near) if is_near]
+        background = [pixel for pixel, is_near in zip(active, near) if not is_near]
         with pm.Model() as model:
             print("X0Y0",resources.get_resource("ref_position").value)
             x0,y0 = resources.get_resource("ref_position").value.get_detector_prior("X0","Y0",detector)
@@ -217,15 +328,21 @@ class LinearTrackModel(ReconsructionModel):
             sigma_psf = resources.get_resource("sigma_psf").create_distribution("sigma_psf")
             individual = resources.get("sigma_individual")
             if individual:
-                sigma = []
+                # One vector variable along pixel dimension instead of scalar per pixel
+                model.add_coord("pixel", [str(pixel.index) for pixel in active])
+                sigma = resources.get_resource("sigma").create_distribution("sigma", dims="pixel")
             else:
                 sigma = resources.get_resource("sigma").create_distribution("sigma")
-            ts = np.arange(k_start,k_end)
-            tensors = []
-            observed = []
+            # Model is evaluated at bin centres
+            ts = pm.floatX(np.arange(k_start,k_end,binning)+(binning-1)/2)
             x = x0 + u0*pm.math.cos(phi0)*(ts-k0)
             y = y0 + u0*pm.math.sin(phi0)*(ts-k0)
-            lc = resources.get_resource("lc").make_lc(ts-k0)
+            # E0 enters likelihood linearly and can be integrated out
+            marginalize = resources.try_get("marginalize_e0")
+            if marginalize:
+                lc = resources.get_resource("lc").make_profile(ts-k0)
+            else:
+                lc = resources.get_resource("lc").make_lc(ts-k0)
 
             # Make columns
             #x = x[:,None]
@@ -237,23 +354,46 @@ class LinearTrackModel(ReconsructionModel):
             #     ypart = pm.math.exp(-(y-yp.T)**2/(2*sigma_psf**2))
             #     return xpart*ypart*lc/(2*np.pi*sigma_psf**2)
 
-            for pixel in detector.pixels:
-                i = pixel.index
-                if detector.pixel_is_active(i):
-                    s = (slice(k_start, k_end),) + i
+            # Observations are concatenated pixel by pixel
+            if resources.try_get("exact_pixel_shape"):
+                # All pixels in one weighted sum over precomputed quadrature nodes
+                xs, ys, ws = map(pm.floatX, detector.quadrature_table(fitted))
+                response = pixel_gaussian_quadrature(xs, ys, ws, x, y, sigma_psf)
+                tensors = (lc[:, None]*response).T.flatten()
+            else:
+                tensors = []
+                for pixel in fitted:
                     min_x, max_x, min_y, max_y = pixel.get_bounds()
-                    v = lc*d_erf(min_x,max_x,x,sigma_psf)*d_erf(min_y,max_y,y,sigma_psf)
-                    # v = pixel.integrate(func,backend=pm.math)
-                    tensors.append(v)
-                    observed.append(data[s])
-                    if individual:
-                        sigma.append(resources.get_resource("sigma").create_distribution(f"sigma #{i}"))
-            tensors = pt.concatenate(tensors)
-            observed = np.concatenate(observed)
+                    tensors.append(lc*pixel_gaussian(min_x,max_x,min_y,max_y,x,y,sigma_psf))
+                tensors = pt.concatenate(tensors)
+            observed = np.concatenate([data[(slice(k_start, k_end),)+pixel.index].reshape(-1, binning).sum(axis=1)
+                                       for pixel in fitted])
+            observed = pm.floatX(observed)
+            if background:
+                # Pixels far from track hold only noise. Their likelihood depends on sum of squares only
+                background_data = np.stack([data[(slice(k_start, k_end),)+pixel.index] for pixel in background])
+                count = background_data.shape[1]
+                sum_squares = pm.floatX(np.sum(background_data**2, axis=1))
+                background_sigma = sigma[np.flatnonzero(~near)] if individual else sigma
+                pm.Potential("background", pt.sum(-count*pt.log(background_sigma)-sum_squares/(2*background_sigma**2))
+                             - background_data.size*np.log(2*np.pi)/2)
             if individual:
-                sigma = pt.concatenate(sigma)
-            pm.Normal("likelyhood",mu=tensors,sigma=sigma,observed=observed)
-            trace = resources.get_resource("pymc_sampling").sample()
-            resources.set("trace",trace)
+                sigma = pt.repeat(sigma[np.flatnonzero(near)], len(ts))
+            if binning > 1:
+                # Bin is sum of frames: signal is multiplied, independent noise adds in quadrature
+                tensors = tensors*binning
+                sigma = sigma*np.sqrt(binning)
+            if marginalize:
+                marginal_gaussian_amplitudes("likelyhood", [tensors], observed, sigma, ["e0"])
+            else:
+                pm.Normal("likelyhood",mu=tensors,sigma=sigma,observed=observed)
+            sample_kwargs = dict()
+            if resources.try_get("warm_start"):
+                initvals = cls.barycentric_initvals(track_estimate, k0-k_start)
+                if set_initvals(model, initvals):
+                    # Jitter would throw chains away from estimate
+                    sample_kwargs["init"] = "adapt_diag"
+            trace = resources.get_resource("pymc_sampling").sample(**sample_kwargs)
+            resources.set("trace",cast_trace(trace, resources.try_get("precision")))
             lc_conf = resources.get_resource("lc").pack()
             resources.set("lc_conf",json.dumps(lc_conf))
\ No newline at end of file
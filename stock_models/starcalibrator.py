@@ -12,11 +12,14 @@ from reco_prelude import ReconsructionModel, ResourceRequest, HDF5Resource, Time
 from reco_prelude import template_normal, NumpyArrayResource, Scene, template_exponent, template_halfnormal
 from RecoResources.prior_resource import ConstantMaker
 from transform import Transform, unixtime_to_era, Quaternion, Vector3, TransformBuilder, observatory_transform
-from transform import ecef_align, projection_matrix, simple_projection_matrix, Vector4
+from transform import ecef_align, projection_matrix, simple_projection_matrix, Vector4, earth_transform
 from stars import StarList
 from star_pin import PinnedStars
 from orientation import OrientationPriorResource
 from track_resources import PyMCSampleArgsResource
+from pymc_sampling import MinibatchAdviOption, PrecisionResource, cast_trace
+from linear_marginal import marginal_gaussian_amplitudes
+from pixel_psf import pixel_gaussian
 from transform import Matrix
 from reco_prelude import LabelledAction
 from matplotlib.patches import  Circle
@@ -27,7 +30,8 @@ from matplotlib.patches import  Circle
 def scene_3d(resources,era,orientation_getter,backend=np):
     latitude = resources.get("latitude") * np.pi / 180.0
     longitude = resources.get("longitude") * np.pi / 180.0
-    earth: Transform = TransformBuilder().with_rotation(Quaternion.rotate_xy(era)).build()
+    # Minibatched frames give symbolic rotation angles
+    earth: Transform = earth_transform(era, np if isinstance(era, np.ndarray) else backend)
 
     # Make observatory and attach it to Earth.
     # Neglect position
@@ -44,17 +48,53 @@ def scene_3d(resources,era,orientation_getter,backend=np):
     return earth, observatory, detector
 
 
-def scene_3d_view(resources,dt=None):
+class SceneTransforms(object):
+    '''
+    Scene hierarchy kept between redraws.
+    Only transforms whose inputs have changed are updated, others keep their cached matrices.
+    '''
+    def __init__(self):
+        self.earth = earth_transform(0.0)
+        self.observatory = TransformBuilder().with_parent(self.earth).build()
+        self.detector = TransformBuilder().with_parent(self.earth).build()
+        self._era = None
+        self._latlon = None
+
+    def update(self, resources, era, orientation_getter):
+        latlon = (resources.get("latitude"), resources.get("longitude"))
+        if latlon != self._latlon:
+            latitude = latlon[0] * np.pi / 180.0
+            longitude = latlon[1] * np.pi / 180.0
+            self.observatory.rotation = observatory_transform(latitude, longitude, apply_position=False).rotation
+            self._latlon = latlon
+        if self._era is None or not np.array_equal(self._era, era):
+            self.earth.rotation = Quaternion.rotate_xy(era)
+            self._era = np.copy(era)
+        detector_orientation = orientation_getter(self.observatory.rotation, "orientation")
+        if detector_orientation is None:
+            return None
+        if detector_orientation != self.detector.rotation:
+            self.detector.rotation = detector_orientation
+        return self.earth, self.observatory, self.detector
+
+
+SKY_TRANSFORMS = SceneTransforms()
+DETECTOR_TRANSFORMS = SceneTransforms()
+
+
+def scene_3d_view(resources,dt=None, transforms=SKY_TRANSFORMS):
+    '''
+    Scene for display purposes.
+    :param dt: unixtime or array of unixtimes. Array produces batched matrices (one per frame)
+    :param transforms: transform hierarchy to update
+    '''
     orientation = resources.get_resource("orientation")
     # chosen_stars = resources.get("stars")
-    f = resources.get_resource("f").get_estimation()
 
     if dt is None:
         dt = resources.get("time_probe").timestamp()
-    else:
-        print("UNIXTIME override:",dt)
     era = unixtime_to_era(dt)
-    return scene_3d(resources, era, orientation.get_rotation_estimation)
+    return transforms.update(resources, era, orientation.get_rotation_estimation)
 
 
 def get_stars():
@@ -84,10 +124,6 @@ def anti_altaz_represent(x,y,z):
     az = np.arctan2(x,y)
     return ralt,az
 
-def d_erf(a,b,mu,sigma):
-    scale = sigma*2**0.5
-    return (pm.math.erf((b-mu)/scale)-pm.math.erf((a-mu)/scale))/2.0
-
 def get_current_frame(resources,time_data):
     k = resources.get("frame_probe")
     if k < 0:
@@ -97,7 +133,7 @@ def get_current_frame(resources,time_data):
     return k
 
 
-@nb.njit(nb.bool_[:,:,:](nb.bool_[:,:,:],nb.int64,nb.int64,nb.int64))
+@nb.njit(nb.bool_[:,:,:](nb.bool_[:,:,:],nb.int64,nb.int64,nb.int64), cache=True)
 def flood_fill(data,t0,x0,y0):
     stack = nb.typed.List()
     result = np.full(fill_value=False,shape=data.shape)
@@ -250,13 +286,13 @@ class DetectorScene(Scene):
         star_list = resources.get_resource("star_list")
         chosen_stars = star_list.get_stars()
 
+        # Only the shown frame is evaluated, transforms unaffected by time stay cached between frames
         if resources.has_resource("time_data"):
             time_data = resources.get("time_data")
             k = get_current_frame(resources,time_data)
-            dt = time_data[k]
+            dat = scene_3d_view(resources, dt=time_data[k], transforms=DETECTOR_TRANSFORMS)
         else:
-            dt = None
-        dat = scene_3d_view(resources,dt=dt)
+            dat = scene_3d_view(resources, transforms=DETECTOR_TRANSFORMS)
         if dat is None:
             return
         earth, observatory, detector = dat
@@ -270,7 +306,8 @@ class DetectorScene(Scene):
             [ 0,0,1,0],
             [ 0,0,0,1]
         ])
-        vp = swap_x@get_vp(detector, f)
+        view = detector.view_matrix(np)
+        vp = swap_x @ projection_matrix(f) @ view
         x,y,z = transform_starvec(suitable_stars,vp)
 
         mags = np.array([x.vmag for x in suitable_stars])
@@ -329,6 +366,7 @@ class StellarModel(ReconsructionModel):
         "signal_data": dict(display_name="Signal data", type_=HDF5Resource),
         "time_data": dict(display_name="Time data", type_=HDF5Resource),
         "pymc_sampling": dict(display_name="PyMC arguments", type_=PyMCSampleArgsResource),
+        "minibatch": dict(display_name="Minibatch ADVI (replaces PyMC sampling)", type_=MinibatchAdviOption),
         "time_probe": dict(display_name="Plot time", type_=TimeResource, category="Display"),
         "frame_probe": dict(display_name="Plot frame", default_value=0, category="Display"),
         "show_all_pixels": dict(display_name="Show all pixels", default_value=True, category="Display"),
@@ -349,6 +387,9 @@ class StellarModel(ReconsructionModel):
         "plane_offset_y": dict(display_name="Focal plane offset Y", default_value=ConstantMaker.template(0.0),
                                category="Priors"),
         "use_cauchy":dict(display_name="Use cauchy error", default_value=True,category="Priors"),
+        "marginalize_amplitudes":dict(display_name="Marginalize star amplitudes analytically (Gaussian error)",
+                                      default_value=False, category="Priors"),
+        "precision":dict(display_name="Floating point precision", type_=PrecisionResource),
         "star_list": dict(display_name="Stars", type_=PinnedStars, category="Star selection")
         # "stars": dict(display_name="Stars", type_=StarListResource),
         # "pdm_width": dict(display_name="PDM width [pixels]", default_value=8),
@@ -374,20 +415,54 @@ class StellarModel(ReconsructionModel):
         times = resources.get("time_data")
 
         mask = resources.get("mask_3d")
-        era = unixtime_to_era(times)
+        era = pm.floatX(unixtime_to_era(times))
+
+        # Projects saved before minibatch mode and amplitude marginalization have no such fields
+        minibatch = resources.get_resource("minibatch").value if resources.has_resource("minibatch") else None
+        marginalize = bool(resources.try_get("marginalize_amplitudes"))
+        if marginalize and (minibatch is not None or resources.get("use_cauchy")):
+            print("Amplitude marginalization requires full data and gaussian error. Sampling amplitudes instead")
+            marginalize = False
 
         with pm.Model() as model:
             # hour_angle = resources.get_resource("hour_angle").create_distribution("GHA") * np.pi / 180
             # declination = resources.get_resource("declination").create_distribution("dec") * np.pi / 180
             # own_rotation = resources.get_resource("own_rotation").create_distribution("Omega") * np.pi / 180
             orientation = resources.get_resource("orientation")
-            amplitude = resources.get_resource("amplitude").create_distribution("amplitude")
+            if marginalize:
+                # Global amplitude is integrated out together with manual star amplitudes
+                amplitude = 1.0
+            else:
+                amplitude = resources.get_resource("amplitude").create_distribution("amplitude")
             f = resources.get_resource("f").create_distribution("f")
             sigma_psf = resources.get_resource("sigma_psf").create_distribution("sigma_psf")
             sigma = resources.get_resource("sigma").create_distribution("sigma")
-            earth, observatory,detector = scene_3d(resources, era, orientation.get_prior, backend=pm.math)
-            p = projection_matrix(f)
-            v = detector.view_matrix()
+            if minibatch is None:
+                frame_era = era
+            else:
+                # Observations are flattened into (frame, pixel bounds, value) rows.
+                # Each iteration evaluates only a random batch of rows
+                obs_frames = []
+                obs_bounds = []
+                obs_values = []
+                for pixel in detector_geometry.pixels:
+                    mask_index = (slice(None),)+pixel.index
+                    mask_row = mask[mask_index]
+                    if mask_row.any():
+                        ks = np.flatnonzero(mask_row)
+                        obs_frames.append(ks)
+                        obs_bounds.append(np.tile(pixel.get_bounds(), (len(ks), 1)))
+                        obs_values.append(signal_data[mask_index][mask_row])
+                obs_frames = np.concatenate(obs_frames)
+                total_size = len(obs_frames)
+                print("Minibatch ADVI on", total_size, "observations")
+                obs_bounds = pm.floatX(np.concatenate(obs_bounds))
+                obs_values = pm.floatX(np.concatenate(obs_values))
+                frame_era, bounds, observed = minibatch.minibatch(era[obs_frames], obs_bounds, obs_values)
+            earth, observatory,detector = scene_3d(resources, frame_era, orientation.get_prior, backend=pm.math)
+            # Stacked tensors keep the graph compact: one matmul per product instead of one node per entry
+            p = projection_matrix(f, backend=pm.math)
+            v = detector.view_matrix(backend=pm.math)
             dx = resources.get_resource("plane_offset_x").create_distribution("dX")
             dy = resources.get_resource("plane_offset_y").create_distribution("dY")
             neg_x = Matrix([
@@ -395,61 +470,101 @@ class StellarModel(ReconsructionModel):
                 [0,1,0,-dy],
                 [0,0,1,0],
                 [0,0,0,1]
-            ])
+            ]).stacked(pm.math)
             vp = neg_x @ p @ v
 
-            chosen_stars, star_amplitudes = resources.get_resource("star_list").get_stars_with_amplitudes()
-
-            estimations = []
-            observed_data = []
-            star_cache = dict()
-
-            for pixel in detector_geometry.pixels:
-                i = pixel.index
-                mask_index = (slice(None),)+i
-                mask_row = mask[mask_index]
-                #print("Pixel time mask", mask_row)
-                #print("Pixel mask shapes", mask.shape,mask_row.shape, mask_index)
-                if mask_row.any():
-                    min_x, max_x, min_y, max_y = pixel.get_bounds()
-                    sum_intensity = None
-                    for star_index in range(len(chosen_stars)):
-                        star = chosen_stars[star_index]
-                        key = star.get_star_identifier()
-                        #print("STAR processing", star, chosen_stars)
-
-                        ampl = star_amplitudes[star_index]
-
-                        if key not in star_cache.keys():
-                            eci = star.eci_direction.to_column4()
-                            x1,y1,z1 = (vp@eci).to_vec4().to_vec3().unpack()
-                            star_cache[key] = (x1,y1,z1,amplitude * ampl)
-                        x,y,z,pre_e0 = star_cache[key]
-                        x = x[mask_row]
-                        y = y[mask_row]
-                        z = z[mask_row]
-                        e0 = pt.switch(z>0, pre_e0, 0.0)
-                        track_v = e0*d_erf(min_x,max_x,x,sigma_psf)*d_erf(min_y,max_y,y,sigma_psf)
-                        if sum_intensity is None:
-                            sum_intensity = track_v
-                        else:
-                            sum_intensity = sum_intensity+track_v
-                    obs = signal_data[mask_index][mask_row]
-                    estimations.append(sum_intensity)
-                    observed_data.append(obs)
-                    print("Intermediate shape:", sum_intensity.shape.eval(), obs.shape)
-
-            tensors = pt.concatenate(estimations)
-            observed = np.concatenate(observed_data)
-            print("Final shape test",tensors.shape.eval(),observed.shape)
-            if resources.get("use_cauchy"):
-                res = pm.Cauchy("likelyhood", alpha=tensors, beta=sigma, observed=observed)
+            if marginalize:
+                chosen_stars, modifiers = resources.get_resource("star_list").get_stars_with_modifiers()
+                free_amplitudes = [modifier.FreeAmplitude for modifier in modifiers]
+                # Magnitude based stars keep their fixed brightness ratios and share global amplitude
+                star_amplitudes = [1.0 if free else modifier.get_rng_modifier(star)
+                                   for star, modifier, free in zip(chosen_stars, modifiers, free_amplitudes)]
+                star_templates = [[] for _ in range(len(chosen_stars))]
+            else:
+                chosen_stars, star_amplitudes = resources.get_resource("star_list").get_stars_with_amplitudes()
+
+            if minibatch is None:
+                estimations = []
+                observed_data = []
+                star_cache = dict()
+
+                for pixel in detector_geometry.pixels:
+                    i = pixel.index
+                    mask_index = (slice(None),)+i
+                    mask_row = mask[mask_index]
+                    #print("Pixel time mask", mask_row)
+                    #print("Pixel mask shapes", mask.shape,mask_row.shape, mask_index)
+                    if mask_row.any():
+                        min_x, max_x, min_y, max_y = pixel.get_bounds()
+                        sum_intensity = None
+                        for star_index in range(len(chosen_stars)):
+                            star = chosen_stars[star_index]
+                            key = star.get_star_identifier()
+                            #print("STAR processing", star, chosen_stars)
+
+                            ampl = star_amplitudes[star_index]
+
+                            if key not in star_cache.keys():
+                                eci = star.eci_direction.to_column4()
+                                x1,y1,z1 = (vp@eci).to_vec4().to_vec3().unpack()
+                                star_cache[key] = (x1,y1,z1,amplitude * ampl)
+                            x,y,z,pre_e0 = star_cache[key]
+                            x = x[mask_row]
+                            y = y[mask_row]
+                            z = z[mask_row]
+                            e0 = pt.switch(z>0, pre_e0, 0.0)
+                            track_v = e0*pixel_gaussian(min_x,max_x,min_y,max_y,x,y,sigma_psf)
+                            if marginalize:
+                                star_templates[star_index].append(track_v)
+                            if sum_intensity is None:
+                                sum_intensity = track_v
+                            else:
+                                sum_intensity = sum_intensity+track_v
+                        obs = signal_data[mask_index][mask_row]
+                        estimations.append(sum_intensity)
+                        observed_data.append(obs)
+                        print("Intermediate shape:", sum_intensity.shape.eval(), obs.shape)
+
+                tensors = pt.concatenate(estimations)
+                observed = pm.floatX(np.concatenate(observed_data))
+                print("Final shape test",tensors.shape.eval(),observed.shape)
+                likelihood_kwargs = dict()
             else:
-                res = pm.Normal("likelyhood", mu=tensors, sigma=sigma, observed=observed)
+                tensors = 0.0
+                for star_index in range(len(chosen_stars)):
+                    eci = chosen_stars[star_index].eci_direction.to_column4()
+                    x, y, z = (vp@eci).to_vec4().to_vec3().unpack()
+                    e0 = pt.switch(z > 0, amplitude*star_amplitudes[star_index], 0.0)
+                    tensors = tensors + e0*pixel_gaussian(bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3],
+                                                          x, y, sigma_psf)
+                # Likelihood of batch is scaled to full data
+                likelihood_kwargs = dict(total_size=total_size)
+            if marginalize:
+                fixed = [pt.concatenate(t) for t, free in zip(star_templates, free_amplitudes) if not free]
+                free_stars = [(star, pt.concatenate(t))
+                              for star, t, free in zip(chosen_stars, star_templates, free_amplitudes) if free]
+                # Coefficient of fixed ratio stars is global amplitude, coefficient of manual star
+                # is product of global amplitude and its own amplitude
+                templates = ([sum(fixed)] if fixed else []) + [t for _, t in free_stars]
+                coefficients = marginal_gaussian_amplitudes("likelyhood", templates, observed, sigma,
+                                                            [None]*len(templates))
+                if fixed:
+                    amplitude = pm.Deterministic("amplitude", coefficients[0])
+                    coefficients = coefficients[1:]
+                for j, (star, _) in enumerate(free_stars):
+                    pm.Deterministic("Amplitude_"+star.get_star_identifier().replace(" ", "_"),
+                                     coefficients[j]/amplitude)
+            elif resources.get("use_cauchy"):
+                res = pm.Cauchy("likelyhood", alpha=tensors, beta=sigma, observed=observed, **likelihood_kwargs)
+            else:
+                res = pm.Normal("likelyhood", mu=tensors, sigma=sigma, observed=observed, **likelihood_kwargs)
 
             #model.profile(res).summary()
-            trace = resources.get_resource("pymc_sampling").sample()
-            resources.set("trace", trace)
+            if minibatch is None:
+                trace = resources.get_resource("pymc_sampling").sample()
+            else:
+                trace = minibatch.sample()
+            resources.set("trace", cast_trace(trace, resources.try_get("precision")))
 
     @LabelledAction("Select pixels")
     @staticmethod
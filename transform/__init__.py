@@ -1,36 +1,44 @@
 import numpy as np
 
-from .astronomy import latlon_to_ecef_position, unixtime_to_era, observatory_transform, ecef_align
+from .astronomy import latlon_to_ecef_position, unixtime_to_era, observatory_transform, ecef_align, earth_transform
 from .transform import Transform, TransformBuilder
 from .vectors import Vector2, Vector3, Quaternion, Vector4
-from .matrices import Matrix
+from .matrices import Matrix, TensorMatrix
 
-def simple_projection_matrix() -> Matrix:
+def simple_projection_matrix(backend=None) -> Matrix:
     '''
     A primitive projection matrix
+    :param backend: if set, matrix is packed into one stacked array
     :return: 4x4 primitive projection matrix
     '''
     m = Matrix.identity(4)
     m.swap_rows(2,3)
     #m[2], m[3] = m[3], m[2]
+    if backend is not None:
+        return m.stacked(backend)
     return m
 
 
-def scale_matrix(sx: float, sy: float, sz: float)-> Matrix:
+def scale_matrix(sx: float, sy: float, sz: float, backend=None)-> Matrix:
     '''
     Scale homogenous matrix
     :param sx: scale factor x
     :param sy: scale factor y
     :param sz: scale factor z
+    :param backend: if set, matrix is packed into one stacked array
     :return: 4x4 scale matrix
     '''
-    return Matrix.diagonal([sx, sy, sz, 1.0])
+    m = Matrix.diagonal([sx, sy, sz, 1.0])
+    if backend is not None:
+        return m.stacked(backend)
+    return m
 
 
-def projection_matrix(f: float)-> Matrix:
+def projection_matrix(f: float, backend=None)-> Matrix:
     '''
     :param f: focal distance
+    :param backend: if set, matrix is packed into one stacked array (use symbolic backend for pymc models)
     :return: 4x4 matrix that also scales x and y by f
     '''
-    m = simple_projection_matrix()
-    return scale_matrix(f, f, 1.0) @ m
+    m = simple_projection_matrix(backend)
+    return scale_matrix(f, f, 1.0, backend) @ m
@@ -77,6 +77,16 @@ def unixtime_to_era(unixtime):
     return np.pi * 2 * (0.7790572732640 + 1.00273781191135448 * ut1) % (2 * np.pi)
 
 
+def earth_transform(era, backend=np) -> Transform:
+    '''
+    Creates transform of Earth rotated by earth rotation angle (ECEF inside ECI).
+    :param era: earth rotation angle. If it is an array, matrices of the hierarchy are batched along it.
+    :param backend: calculation backend
+    :return:
+    '''
+    return TransformBuilder().with_rotation(Quaternion.rotate_xy(era, backend)).build()
+
+
 def observatory_transform(lat:float, lon:float,elevation=0.0,apply_position=True,backend=np):
     '''
     Creates transform with local axes aligned according to OCEF.
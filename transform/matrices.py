@@ -1,5 +1,8 @@
+import sys
 from typing import List, Any
 
+import numpy as np
+
 
 def estimate_shape(data:List[List[Any]]):
     if len(data)==0:
@@ -67,6 +70,8 @@ class Matrix(object):
     def __matmul__(self, other):
         if self.columns != other.rows:
             raise ValueError(f"Cannot multiply matrix with shape {self.shape} by {other.shape}")
+        if isinstance(other, TensorMatrix):
+            return self.stacked() @ other
         res = type(self).blank(self.rows,other.columns)
         for i in range(self.rows):
             for j in range(other.columns):
@@ -123,3 +128,153 @@ class Matrix(object):
             return Vector4(*self.column(0))
         else:
             raise ValueError(f"Matrix of shape {self.shape} cannot be turned into (column) 4d vector")
+
+    def stacked(self, backend=None):
+        '''
+        Pack matrix entries into one stacked array.
+        Entries are broadcast against each other, so per-frame arrays become a batch of matrices.
+        :param backend: calculation backend. Non-numpy backend (or any symbolic entry) produces pytensor tensor.
+        :return: TensorMatrix with data of shape (..., rows, columns)
+        '''
+        entries = [x for row in self.matrix_data for x in row]
+        lib = array_module(backend)
+        if lib is np and any(map(is_symbolic, entries)):
+            lib = tensor_module()
+        if lib is np:
+            entries = np.broadcast_arrays(*entries)
+        else:
+            entries = [lib.as_tensor_variable(x) for x in entries]
+            if any(x.ndim > 0 for x in entries):
+                entries = lib.broadcast_arrays(*entries)
+        rows = []
+        for i in range(self.rows):
+            rows.append(lib.stack(entries[i*self.columns:(i+1)*self.columns], axis=-1))
+        return TensorMatrix(lib.stack(rows, axis=-2), self.shape)
+
+
+def array_module(backend=None):
+    '''
+    Pick array library for given calculation backend.
+    :param backend: calculation backend (numpy, pytensor.tensor, pymc.math, ...)
+    :return: numpy or pytensor.tensor
+    '''
+    if backend is None or backend is np:
+        return np
+    return tensor_module()
+
+
+def tensor_module():
+    import pytensor.tensor as pt
+    return pt
+
+
+def is_symbolic(x):
+    '''
+    Checks if value is a pytensor variable
+    '''
+    # Nothing can be symbolic until pytensor is imported by someone
+    basic = sys.modules.get("pytensor.graph.basic")
+    if basic is None:
+        return False
+    return isinstance(x, basic.Variable)
+
+
+def _multiply(a, b):
+    '''
+    Product of two stacked arrays of shape (..., rows, columns)
+    '''
+    if not (is_symbolic(a) or is_symbolic(b)):
+        return np.matmul(a, b)
+    pt = tensor_module()
+    a = pt.as_tensor_variable(a)
+    b = pt.as_tensor_variable(b)
+    if a.ndim == 2 and b.ndim == 2:
+        return pt.dot(a, b)
+    if a.ndim == 2:
+        # Single matrix applied to a batch: one dot, batch dimensions move to the front afterwards
+        res = pt.tensordot(a, b, axes=[[1], [b.ndim-2]])
+        return pt.moveaxis(res, 0, -2)
+    if b.ndim == 2:
+        return pt.tensordot(a, b, axes=[[a.ndim-1], [0]])
+    return (a[..., :, :, None] * b[..., None, :, :]).sum(axis=-2)
+
+
+def _can_merge(a, b):
+    '''
+    Checks if two neighbouring factors can be multiplied without growing the graph
+    '''
+    numeric = not (is_symbolic(a) or is_symbolic(b))
+    return numeric or (np.ndim(a) == 2 and np.ndim(b) == 2)
+
+
+class TensorMatrix(object):
+    '''
+    Matrix stored as stacked arrays of shape (..., rows, columns).
+    Leading dimensions are batch dimensions (e.g. frames).
+    Product is kept as a chain of factors: numeric factors are multiplied by numpy right away,
+    symbolic ones are multiplied only when data is requested.
+    That way symbolic 4x4 matrices meet per-frame arrays in one dot product instead of one node per entry.
+    '''
+    def __init__(self, data, shape, factors=None):
+        if factors is None:
+            factors = [data]
+        self.factors = factors
+        self.shape = tuple(shape)
+
+    def __repr__(self):
+        return f"TensorMatrix{self.shape}({self.factors})"
+
+    @classmethod
+    def from_matrix(cls, matrix, backend=None):
+        if isinstance(matrix, TensorMatrix):
+            return matrix
+        return matrix.stacked(backend)
+
+    @property
+    def data(self):
+        res = self.factors[-1]
+        for factor in reversed(self.factors[:-1]):
+            res = _multiply(factor, res)
+        return res
+
+    @property
+    def rows(self):
+        return self.shape[0]
+
+    @property
+    def columns(self):
+        return self.shape[1]
+
+    def is_symbolic(self):
+        return any(map(is_symbolic, self.factors))
+
+    def __getitem__(self, item):
+        return self.data[..., item[0], item[1]]
+
+    def __matmul__(self, other):
+        if self.columns != other.rows:
+            raise ValueError(f"Cannot multiply matrix with shape {self.shape} by {other.shape}")
+        if not isinstance(other, TensorMatrix):
+            other = other.stacked()
+        factors = list(self.factors)
+        for factor in other.factors:
+            if _can_merge(factors[-1], factor):
+                factors[-1] = _multiply(factors[-1], factor)
+            else:
+                factors.append(factor)
+        return TensorMatrix(None, (self.rows, other.columns), factors)
+
+    def column(self, j):
+        data = self.data
+        return [data[..., i, j] for i in range(self.rows)]
+
+    def row(self, i):
+        data = self.data
+        return [data[..., i, j] for j in range(self.columns)]
+
+    def to_vec4(self):
+        from .vectors import Vector4
+        if self.shape == (4, 1):
+            return Vector4(*self.column(0))
+        else:
+            raise ValueError(f"Matrix of shape {self.shape} cannot be turned into (column) 4d vector")
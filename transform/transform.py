@@ -1,3 +1,4 @@
+import weakref
 from typing import Optional, Any
 
 import numpy as np
@@ -7,31 +8,109 @@ from .matrices import Matrix
 
 
 class Transform(object):
+    '''
+    Node of transform hierarchy.
+    Local and world matrices are cached. Assigning position, rotation or parent marks the transform
+    (and all its children) dirty, so cached matrices are recomputed only when something has changed.
+    Note: in-place modification of position/rotation objects is not tracked, assign new ones instead.
+    '''
     def __init__(self,position:Vector3,rotation:Quaternion, parent: Optional[Any] = None):
+        self._local_cache = dict()
+        self._world_cache = dict()
+        self._children = weakref.WeakSet()
+        self._parent = None
         self.position = position
         self.rotation = rotation
         self.parent = parent
 
-    def local_model_matrix(self) -> Matrix:
-        rot = self.rotation.to_mat4()
-        pos = self.position.to_mat4()
+    @property
+    def position(self) -> Vector3:
+        return self._position
+
+    @position.setter
+    def position(self, value:Vector3):
+        self._position = value
+        self.mark_dirty(local=True)
+
+    @property
+    def rotation(self) -> Quaternion:
+        return self._rotation
+
+    @rotation.setter
+    def rotation(self, value:Quaternion):
+        self._rotation = value
+        self.mark_dirty(local=True)
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @parent.setter
+    def parent(self, value):
+        if self._parent is not None:
+            self._parent._children.discard(self)
+        self._parent = value
+        if value is not None:
+            value._children.add(self)
+        self.mark_dirty()
+
+    def mark_dirty(self, local=False):
+        '''
+        Drop cached matrices. World matrices of children are dropped too.
+        :param local: drop local matrices as well (position or rotation has changed)
+        '''
+        if local:
+            self._local_cache.clear()
+        self._world_cache.clear()
+        for child in self._children:
+            child.mark_dirty()
+
+    @staticmethod
+    def _cached(cache, key, factory):
+        if key not in cache:
+            cache[key] = factory()
+        return cache[key]
+
+    def local_model_matrix(self, backend=None) -> Matrix:
+        return self._cached(self._local_cache, ("model", backend), lambda: self._make_local_model_matrix(backend))
+
+    def local_view_matrix(self, backend=None) -> Matrix:
+        return self._cached(self._local_cache, ("view", backend), lambda: self._make_local_view_matrix(backend))
+
+    def _make_local_model_matrix(self, backend=None) -> Matrix:
+        rot = self.rotation.to_mat4(backend)
+        pos = self.position.to_mat4(backend)
         return pos @ rot
 
-    def local_view_matrix(self) -> Matrix:
-        inv_rot = self.rotation.conj().to_mat4()
-        inv_pos = (-self.position).to_mat4()
+    def _make_local_view_matrix(self, backend=None) -> Matrix:
+        inv_rot = self.rotation.conj().to_mat4(backend)
+        inv_pos = (-self.position).to_mat4(backend)
         return inv_rot @ inv_pos
 
-    def model_matrix(self):
-        m = self.local_model_matrix()
+    def model_matrix(self, backend=None):
+        '''
+        :param backend: if set, matrices are built as stacked arrays (TensorMatrix)
+        :return: local to world matrix
+        '''
+        return self._cached(self._world_cache, ("model", backend), lambda: self._make_model_matrix(backend))
+
+    def view_matrix(self, backend=None):
+        '''
+        :param backend: if set, matrices are built as stacked arrays (TensorMatrix)
+        :return: world to local matrix
+        '''
+        return self._cached(self._world_cache, ("view", backend), lambda: self._make_view_matrix(backend))
+
+    def _make_model_matrix(self, backend=None):
+        m = self.local_model_matrix(backend)
         if self.parent is not None:
-            m = self.parent.model_matrix() @ m
+            m = self.parent.model_matrix(backend) @ m
         return m
 
-    def view_matrix(self):
-        v = self.local_view_matrix()
+    def _make_view_matrix(self, backend=None):
+        v = self.local_view_matrix(backend)
         if self.parent is not None:
-            v = v @ self.parent.view_matrix()
+            v = v @ self.parent.view_matrix(backend)
         return v
 
 
@@ -390,13 +390,16 @@ class Vector3(object):
             [0.0,0.0,0.0,1.0],
         ])
 
-    def to_mat4(self):
-        return Matrix([
+    def to_mat4(self, backend=None):
+        m = Matrix([
             [1.0,0.0,0.0,self.x],
             [0.0,1.0,0.0,self.y],
             [0.0,0.0,1.0,self.z],
             [0.0,0.0,0.0,1.0],
         ])
+        if backend is not None:
+            return m.stacked(backend)
+        return m
 
     def to_list(self):
         return [self.x, self.y, self.z]
@@ -468,7 +471,12 @@ class Quaternion(object):
         ])
         return q
 
-    def to_mat4(self):
+    def to_mat4(self, backend=None):
+        '''
+        Rotation matrix in homogenous coordinates
+        :param backend: if set, matrix is packed into one stacked array (see Matrix.stacked)
+        :return: 4x4 matrix
+        '''
         x = self.x
         y = self.y
         z = self.z
@@ -479,6 +487,8 @@ class Quaternion(object):
             [2 * x * z - 2 * y * w, 2 * y * z + 2 * x * w, 1 - 2 * x ** 2 - 2 * y ** 2, 0.0],
             [0.0, 0.0, 0.0, 1.0]
         ])
+        if backend is not None:
+            return q.stacked(backend)
         return q
 
 